@@ -0,0 +1,54 @@
+#
+# This file is part of Cube Builder.
+# Copyright (C) 2022 INPE.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+#
+
+"""Add activity composite indexes.
+
+Revision ID: 3e5a1c7d9b24
+Revises: b160749a148e
+Create Date: 2026-10-15 10:12:41.508233
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3e5a1c7d9b24'
+down_revision = 'b160749a148e'
+branch_labels = ()
+depends_on = None
+
+
+def upgrade():
+    """Upgrade this migration."""
+    op.execute('DROP INDEX IF EXISTS cube_builder.idx_cube_builder_activities_collection_id')
+    op.execute('DROP INDEX IF EXISTS cube_builder.idx_cube_builder_activities_warped_collection_id')
+    op.create_index('idx_cube_builder_activities_collection_id_tile_id_date', 'activities',
+                    ['collection_id', 'tile_id', 'date'], unique=False, schema='cube_builder')
+    op.create_index('idx_cube_builder_activities_warped_collection_id_tile_id_date', 'activities',
+                    ['warped_collection_id', 'tile_id', 'date'], unique=False, schema='cube_builder')
+
+
+def downgrade():
+    """Downgrade this migration."""
+    op.drop_index('idx_cube_builder_activities_warped_collection_id_tile_id_date', table_name='activities',
+                  schema='cube_builder')
+    op.drop_index('idx_cube_builder_activities_collection_id_tile_id_date', table_name='activities',
+                  schema='cube_builder')
+    op.create_index(op.f('idx_cube_builder_activities_warped_collection_id'), 'activities', ['warped_collection_id'],
+                    unique=False, schema='cube_builder')
+    op.create_index(op.f('idx_cube_builder_activities_collection_id'), 'activities', ['collection_id'],
+                    unique=False, schema='cube_builder')
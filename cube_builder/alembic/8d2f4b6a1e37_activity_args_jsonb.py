@@ -0,0 +1,46 @@
+#
+# This file is part of Cube Builder.
+# Copyright (C) 2022 INPE.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+#
+
+"""Store activity args as JSONB.
+
+Revision ID: 8d2f4b6a1e37
+Revises: 3e5a1c7d9b24
+Create Date: 2026-10-15 10:48:03.114790
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '8d2f4b6a1e37'
+down_revision = '3e5a1c7d9b24'
+branch_labels = ()
+depends_on = None
+
+
+def upgrade():
+    """Upgrade this migration."""
+    op.alter_column('activities', 'args', type_=postgresql.JSONB(), existing_type=sa.JSON(),
+                    postgresql_using='args::jsonb', schema='cube_builder')
+
+
+def downgrade():
+    """Downgrade this migration."""
+    op.alter_column('activities', 'args', type_=sa.JSON(), existing_type=postgresql.JSONB(),
+                    postgresql_using='args::json', schema='cube_builder')
@@ -26,6 +26,7 @@ import requests
 from celery import current_app
 
 from ..config import Config
+from ..utils import ttl_cache
 
 
 def list_running_tasks():
@@ -42,6 +43,7 @@ def list_pending_tasks():
     return inspector.reserved()
 
 
+@ttl_cache(5)
 def list_queues():
     """List all cube-builder queues from RabbitMQ."""
     url = urlparse(Config.RABBIT_MQ_URL)
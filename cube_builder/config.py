@@ -81,6 +81,14 @@ class Config:
 
     STAC_URL = os.environ.get('STAC_URL', 'https://brazildatacube.dpi.inpe.br/stac/')
     MAX_THREADS_IMAGE_VALIDATOR = int(os.environ.get('MAX_THREADS_IMAGE_VALIDATOR', os.cpu_count()))
+    # Each band index thread holds the window buffers of all the input bands
+    MAX_THREADS_BAND_INDEX = int(os.environ.get('MAX_THREADS_BAND_INDEX', 2))
+    # Each merge thread holds a reprojected tile in memory
+    MAX_THREADS_MERGE = int(os.environ.get('MAX_THREADS_MERGE', 2))
+    # Each blend thread holds the window stack of all scenes in memory
+    MAX_THREADS_BLEND = int(os.environ.get('MAX_THREADS_BLEND', 2))
+    # Check with a HEAD request if the merge assets are reachable before reading them
+    CHECK_ASSET_ACCESS = to_bool(os.getenv('CHECK_ASSET_ACCESS', '1'))
     # rasterio
     RASTERIO_ENV = dict(
         GDAL_DISABLE_READDIR_ON_OPEN=True,
@@ -88,6 +96,12 @@ class Config:
     )
     # Access Token
     FLASK_ACCESS_TOKEN = os.getenv('FLASK_ACCESS_TOKEN', None)
+    MAX_JSON_BYTES = int(os.getenv('MAX_JSON_BYTES', 2 * 1024 * 1024))
+    """Maximum size in bytes of the JSON bodies sent to the POST/PUT routes.
+    Larger requests are rejected with ``413`` before parsing. Defaults to ``2 MiB``."""
+    MAX_CONTENT_LENGTH = MAX_JSON_BYTES
+    """Flask limit of the form and multipart bodies, set from ``MAX_JSON_BYTES``.
+    The JSON bodies are checked by the views."""
 
     # Add prefix path to the items. Base path is /Repository
     # So the asset will be /Repository/Mosaic/collectionName/version/tile/period/scene.tif
@@ -18,36 +18,65 @@
 
 
 """Define Cube Builder business interface."""
-from copy import deepcopy
+import math
 from datetime import datetime
-from typing import Tuple, Union
+from typing import List, Sequence, Tuple, Union
 
 # 3rdparty
 import sqlalchemy
 from bdc_catalog.models import (Band, BandSRC, Collection, CollectionSRC, CompositeFunction, GridRefSys, Item, MimeType,
                                 Quicklook, ResolutionUnit, SpatialRefSys, Tile, db)
+from flask import g, has_request_context
 from rasterio.crs import CRS
 from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 from werkzeug.exceptions import NotFound, abort
 
 from . import constants
 from .forms import CollectionForm
 from .grids import create_grids
 from .models import Activity, CubeParameters
-from .utils import get_srid_column
+from .utils import get_srid_column, ttl_cache
 from .utils.image import validate_merges
 from .utils.processing import get_or_create_model
 from .utils.serializer import Serializer
 from .utils.timeline import Timeline
 
+_DEFAULT_BAND_NAMES = frozenset({
+    constants.CLEAR_OBSERVATION_NAME.lower(),
+    constants.TOTAL_OBSERVATION_NAME.lower(),
+    constants.PROVENANCE_NAME.lower(),
+})
+"""Lowered names of the data cube default bands, which are not created from user band definitions."""
+
 
 class CubeController:
     """Define Cube Builder interface for data cube creation."""
 
     @staticmethod
     def get_cube_or_404(cube_id: Union[int, str] = None):
-        """Try to retrieve a data cube on database and raise 404 when not found."""
-        return Collection.get_by_id(cube_id)
+        """Try to retrieve a data cube on database and raise 404 when not found.
+
+        Note:
+            Inside a HTTP request, the data cube is cached in ``flask.g`` to avoid loading it twice.
+        """
+        if not has_request_context():
+            return Collection.get_by_id(cube_id)
+
+        cache = g.setdefault('_cube_builder_cubes', dict())
+        if cube_id not in cache:
+            cache[cube_id] = Collection.get_by_id(cube_id)
+
+        return cache[cube_id]
+
+    @staticmethod
+    def _clear_cube_cache():
+        """Drop the data cubes cached by :meth:`get_cube_or_404` in the current request.
+
+        It must be called by the methods which change a data cube, so the next lookups load it again.
+        """
+        if has_request_context():
+            g.pop('_cube_builder_cubes', None)
 
     @classmethod
     def get_or_create_band(cls, cube, name, common_name, min_value, max_value,
@@ -91,14 +120,99 @@ class CubeController:
         bands = []
 
         for band in metadata['expression']['bands']:
-            bands.append(band_map[band].id)
+            bands.append(band_map[band])
 
         metadata['expression']['bands'] = bands
 
         return metadata
 
+    @staticmethod
+    def _insert_bands(band_rows: List[dict]) -> dict:
+        """Insert the given band rows with a single statement.
+
+        The rows may use the ``Band`` attribute names, like ``metadata_``.
+
+        Returns:
+            Map of band name and the generated band identifier.
+        """
+        if not band_rows:
+            return dict()
+
+        # Core inserts match the table column keys (like ``metadata``), not the ORM attribute names (``metadata_``)
+        columns = {prop.key: prop.columns[0].key for prop in sqlalchemy.inspect(Band).column_attrs}
+        band_rows = [{columns.get(key, key): value for key, value in row.items()} for row in band_rows]
+
+        result = db.session.execute(sqlalchemy.insert(Band).returning(Band.id, Band.name), band_rows)
+
+        return {row.name: row.id for row in result}
+
+    @classmethod
+    def _create_cube_bands(cls, cube: Collection, params: dict, bands: Sequence[dict], eo_metadata: dict,
+                           resolution_unit_id: int, mime_type_id: int) -> dict:
+        """Create the data cube bands (and the band provenance of indexes) using batch inserts.
+
+        Returns:
+            Map of band name and the generated band identifier.
+        """
+        band_map = dict()
+        band_rows = []
+        band_sources = []
+
+        for band in bands:
+            name = band['name'].strip()
+
+            if name.lower() in _DEFAULT_BAND_NAMES:
+                continue
+
+            is_not_cloud = params['quality_band'] != band['name'] if params.get('quality_band') is not None else False
+
+            data_type = band['data_type']
+
+            metadata = dict(eo_metadata)
+
+            if band.get('metadata'):
+                expression = band['metadata'].get('expression') or dict()
+                # Band expressions refer to bands by id, so the referenced bands must be persisted first.
+                if any(ref not in band_map for ref in expression.get('bands', [])):
+                    band_map.update(cls._insert_bands(band_rows))
+                    band_rows = []
+
+                metadata.update(cls._validate_band_metadata(_clone_band_metadata(band['metadata']), band_map))
+
+            band_rows.append(dict(
+                name=name,
+                common_name=band['common_name'],
+                collection_id=cube.id,
+                min_value=-10000 if band.get('metadata') else 0,
+                max_value=10000,
+                nodata=band['nodata'],
+                scale_mult=0.0001 if is_not_cloud else 1,
+                scale_add=params.get('scale_add'),
+                data_type=data_type,
+                resolution_unit_id=resolution_unit_id,
+                description='',
+                mime_type_id=mime_type_id,
+                metadata_=metadata
+            ))
+
+            if metadata.get('expression'):
+                band_sources.append((name, metadata['expression']['bands']))
+
+        band_map.update(cls._insert_bands(band_rows))
+
+        bandsrc_rows = [
+            dict(band_src_id=band_src_id, band_id=band_map[name])
+            for name, band_src_ids in band_sources
+            for band_src_id in band_src_ids
+        ]
+        if bandsrc_rows:
+            db.session.execute(sqlalchemy.insert(BandSRC), bandsrc_rows)
+
+        return band_map
+
     @classmethod
-    def _create_cube_definition(cls, cube_id: str, params: dict) -> dict:
+    def _create_cube_definition(cls, cube_id: str, params: dict, bands: Sequence[dict],
+                                resolution_unit_id: int, mime_type_id: int) -> dict:
         """Create a data cube definition.
 
         Basically, the definition consists in `Collection` and `Band` attributes.
@@ -109,6 +223,9 @@ class CubeController:
         Args:
             cube_id - Data cube
             params - Dict of required values to create data cube. See @validators.py
+            bands - Sequence of band definitions (bands and indexes) to create.
+            resolution_unit_id - Resolution unit identifier used by the data cube bands.
+            mime_type_id - Mime type identifier used by the data cube bands.
 
         Returns:
             A serialized data cube information.
@@ -131,12 +248,14 @@ class CubeController:
         if cube_function is None:
             abort(404, f'Function {function} not found.')
 
-        data = dict(name='Meter', symbol='m')
-        resolution_meter, _ = get_or_create_model(ResolutionUnit, defaults=data, symbol='m')
+        # The EO metadata is the same for every band of the cube, compute it once.
+        eo_band = Band()
+        eo_band.add_eo_meta(resolution_x=params['resolution'], resolution_y=params['resolution'])
+        eo_metadata = eo_band.metadata_
 
-        mime_type, _ = get_or_create_model(MimeType, defaults=dict(name=constants.COG_MIME_TYPE), name=constants.COG_MIME_TYPE)
+        created = cube is None
 
-        if cube is None:
+        if created:
             cube = Collection(
                 name=cube_id,
                 title=params['title'],
@@ -155,55 +274,12 @@ class CubeController:
 
             cube.save(commit=False)
 
-            bands = []
-
-            default_bands = (constants.CLEAR_OBSERVATION_NAME.lower(), constants.TOTAL_OBSERVATION_NAME.lower(), constants.PROVENANCE_NAME.lower())
-
-            band_map = dict()
-
-            for band in params['bands']:
-                name = band['name'].strip()
-
-                if name.lower() in default_bands:
-                    continue
-
-                is_not_cloud = params['quality_band'] != band['name'] if params.get('quality_band') is not None else False
-
-                data_type = band['data_type']
-
-                band_model = Band(
-                    name=name,
-                    common_name=band['common_name'],
-                    collection=cube,
-                    min_value=-10000 if band.get('metadata') else 0,
-                    max_value=10000,
-                    nodata=band['nodata'],
-                    scale_mult=0.0001 if is_not_cloud else 1,
-                    scale_add=params.get('scale_add'),
-                    data_type=data_type,
-                    resolution_unit_id=resolution_meter.id,
-                    description='',
-                    mime_type_id=mime_type.id
-                )
-
-                band_model.add_eo_meta(resolution_x=params['resolution'], resolution_y=params['resolution'])
+            band_map = cls._create_cube_bands(cube, params, bands, eo_metadata,
+                                              resolution_unit_id=resolution_unit_id, mime_type_id=mime_type_id)
 
-                if band.get('metadata'):
-                    band_model.metadata_.update(cls._validate_band_metadata(deepcopy(band['metadata']), band_map))
-
-                band_model.save(commit=False)
-                bands.append(band_model)
-
-                band_map[name] = band_model
-
-                if band_model.metadata_ and band_model.metadata_.get('expression'):
-                    for _band_origin_id in band_model.metadata_['expression']['bands']:
-                        band_provenance = BandSRC(band_src_id=_band_origin_id, band_id=band_model.id)
-                        band_provenance.save(commit=False)
-
-            quicklook = Quicklook(red=band_map[params['bands_quicklook'][0]].id,
-                                  green=band_map[params['bands_quicklook'][1]].id,
-                                  blue=band_map[params['bands_quicklook'][2]].id,
+            quicklook = Quicklook(red=band_map[params['bands_quicklook'][0]],
+                                  green=band_map[params['bands_quicklook'][1]],
+                                  blue=band_map[params['bands_quicklook'][2]],
                                   collection=cube)
 
             quicklook.save(commit=False)
@@ -219,23 +295,33 @@ class CubeController:
         db.session.add(cube_parameters)
 
         # Create default Cube Bands
-        if function != constants.IDENTITY:
-            _ = cls.get_or_create_band(cube.id, **constants.CLEAR_OBSERVATION_ATTRIBUTES, mime_type_id=mime_type.id,
-                                       resolution_unit_id=resolution_meter.id,
-                                       resolution_x=params['resolution'], resolution_y=params['resolution'])
-            _ = cls.get_or_create_band(cube.id, **constants.TOTAL_OBSERVATION_ATTRIBUTES, mime_type_id=mime_type.id,
-                                       resolution_unit_id=resolution_meter.id,
-                                       resolution_x=params['resolution'], resolution_y=params['resolution'])
-
-            if function in ('STK', 'LCF'):
-                _ = cls.get_or_create_band(cube.id, **constants.PROVENANCE_ATTRIBUTES, mime_type_id=mime_type.id,
-                                           resolution_unit_id=resolution_meter.id,
-                                           resolution_x=params['resolution'], resolution_y=params['resolution'])
+        default_bands = _default_band_attributes(function, params)
 
-        if params.get('is_combined') and function != 'MED':
-            _ = cls.get_or_create_band(cube.id, **constants.DATASOURCE_ATTRIBUTES, mime_type_id=mime_type.id,
-                                       resolution_unit_id=resolution_meter.id,
-                                       resolution_x=params['resolution'], resolution_y=params['resolution'])
+        if created:
+            # A new data cube does not have any default band yet: skip the lookups and insert them at once.
+            cls._insert_bands([
+                dict(
+                    name=attributes['name'],
+                    common_name=attributes['common_name'],
+                    collection_id=cube.id,
+                    min_value=attributes['min_value'],
+                    max_value=attributes['max_value'],
+                    nodata=attributes['nodata'],
+                    scale_mult=attributes['scale'],
+                    scale_add=0,
+                    data_type=attributes['data_type'],
+                    resolution_unit_id=resolution_unit_id,
+                    description=attributes['description'],
+                    mime_type_id=mime_type_id,
+                    metadata_=dict(eo_metadata)
+                )
+                for attributes in default_bands
+            ])
+        else:
+            for attributes in default_bands:
+                _ = cls.get_or_create_band(cube.id, **attributes, mime_type_id=mime_type_id,
+                                           resolution_unit_id=resolution_unit_id,
+                                           resolution_x=params['resolution'], resolution_y=params['resolution'])
 
         return CollectionForm().dump(cube)
 
@@ -255,13 +341,24 @@ class CubeController:
         if params.get('datacube_identity'):
             cube_identity = params['datacube_identity']
 
-        params['bands'].extend(params['indexes'])
+        # Merge bands and indexes once without mutating the given params
+        all_bands = tuple(params['bands']) + tuple(params['indexes'])
 
         with db.session.begin_nested():
+            # Resolve the band resolution unit and mime type once for both data cube definitions
+            data = dict(name='Meter', symbol='m')
+            resolution_meter, _ = get_or_create_model(ResolutionUnit, defaults=data, symbol='m')
+
+            mime_type, _ = get_or_create_model(MimeType, defaults=dict(name=constants.COG_MIME_TYPE), name=constants.COG_MIME_TYPE)
+
+            # Ensure identifiers are generated when the models were just created
+            db.session.flush()
+
+            band_refs = dict(resolution_unit_id=resolution_meter.id, mime_type_id=mime_type.id)
+
             # Create data cube Identity
-            identity_params = deepcopy(params)
-            identity_params['composite_function'] = constants.IDENTITY
-            cube = cls._create_cube_definition(cube_identity, identity_params)
+            identity_params = dict(params, composite_function=constants.IDENTITY)
+            cube = cls._create_cube_definition(cube_identity, identity_params, all_bands, **band_refs)
 
             cube_serialized = [cube]
 
@@ -271,7 +368,7 @@ class CubeController:
                                f'Composed {cube_name} and Identity {cube_identity}')
 
                 # Create data cube with temporal composition
-                cube_composite = cls._create_cube_definition(cube_name, params)
+                cube_composite = cls._create_cube_definition(cube_name, params, all_bands, **band_refs)
                 cube_serialized.append(cube_composite)
 
                 # Create relationship between identity and composed
@@ -301,30 +398,60 @@ class CubeController:
             cube.is_available = params.get('is_available') or cube.is_available
 
             if params.get('bands'):
-                band_map = {b.id: b for b in cube.bands}
+                band_ids = {b.id for b in cube.bands}
                 for band_meta in params['bands']:
-                    if band_meta.get('id') not in band_map or band_meta.get('collection_id') != cube.id:
+                    if band_meta.get('id') not in band_ids or band_meta.get('collection_id') != cube.id:
                         abort(400, f'Band "{band_meta.get("id")}" does not belongs to cube "{cube.name}-{cube.version}"')
 
-                    band_ctx = band_map[band_meta['id']]
-                    for prop, value in band_meta.items():
-                        setattr(band_ctx, prop, value)
+                # The bulk update matches the Band attribute names, so the column keys (like ``metadata``)
+                # are mapped to them and any other key is rejected instead of silently dropped
+                attributes = dict()
+                for prop in sqlalchemy.inspect(Band).column_attrs:
+                    attributes[prop.columns[0].key] = prop.key
+                    attributes[prop.key] = prop.key
+
+                band_rows = []
+                for band_meta in params['bands']:
+                    invalid = [key for key in band_meta if key not in attributes]
+                    if invalid:
+                        abort(400, f'Invalid band properties {", ".join(invalid)}')
+                    band_rows.append({attributes[key]: value for key, value in band_meta.items()})
+
+                # Update all the bands at once, skipping the per attribute ORM instrumentation
+                db.session.bulk_update_mappings(Band, band_rows)
+
+                # The bulk update skips the ORM, so the loaded bands are expired to be read again
+                for band in cube.bands:
+                    db.session.expire(band)
 
         db.session.commit()
+        cls._clear_cube_cache()
 
         return {'message': 'Updated cube!'}, 200
 
     @classmethod
     def get_cube(cls, cube_id: int):
         """Retrieve a data cube definition metadata."""
-        cube = cls.get_cube_or_404(cube_id=int(cube_id))
+        cube = (
+            Collection.query()
+            .options(
+                joinedload(Collection.bands),
+                joinedload(Collection.quicklook),
+                joinedload(Collection.grs),
+                joinedload(Collection.composite_function),
+            )
+            .filter(Collection.id == int(cube_id))
+            .first_or_404(f'Cube {cube_id} not found')
+        )
 
         dump_cube = Serializer.serialize(cube)
         dump_cube['bands'] = [Serializer.serialize(b) for b in cube.bands]
+        band_by_id = {b.id: b.name for b in cube.bands}
+        quicklook = cube.quicklook[0]
         dump_cube['quicklook'] = [
-            list(filter(lambda b: b.id == cube.quicklook[0].red, cube.bands))[0].name,
-            list(filter(lambda b: b.id == cube.quicklook[0].green, cube.bands))[0].name,
-            list(filter(lambda b: b.id == cube.quicklook[0].blue, cube.bands))[0].name
+            band_by_id[quicklook.red],
+            band_by_id[quicklook.green],
+            band_by_id[quicklook.blue]
         ]
         dump_cube['spatial_extent'] = None
         dump_cube['grid'] = cube.grs.name
@@ -366,20 +493,14 @@ class CubeController:
 
         cubes = Collection.query().filter(*where).order_by(Collection.id).all()
 
-        serializer = CollectionForm()
-
-        list_cubes = []
-
-        for cube in cubes:
-            cube_dict = serializer.dump(cube)
+        list_cubes = CollectionForm(many=True).dump(cubes)
 
+        for cube_dict in list_cubes:
             # TODO: count activities from database and compare with execution
             count_tasks = 0
 
             cube_dict['status'] = 'Finished' if count_tasks == 0 else 'Pending'
 
-            list_cubes.append(cube_dict)
-
         return list_cubes, 200
 
     @classmethod
@@ -387,16 +508,21 @@ class CubeController:
         """Retrieve a data cube status, which includes total items, tiles, etc."""
         cube = cls.get_cube_or_404(cube_name)
 
-        dates = (
+        count_items = (
+            db.session.query(func.count(Item.id))
+            .filter(Item.collection_id == cube.id)
+            .scalar_subquery()
+        )
+
+        # Retrieve both activity dates and total items in a single round-trip
+        start_date, last_date, count_items = (
             db.session.query(
-                sqlalchemy.func.min(Activity.created), sqlalchemy.func.max(Activity.created)
+                func.min(Activity.created), func.max(Activity.created), count_items
             )
             .filter(Activity.collection_id == cube_name)
-            .first()
+            .one()
         )
 
-        count_items = db.session.query(Item.id).filter(Item.collection_id == cube.id).count()
-
         count_tasks = 0
 
         if count_tasks > 0:
@@ -409,23 +535,40 @@ class CubeController:
 
         return dict(
             finished=True,
-            start_date=str(dates[0]),
-            last_date=str(dates[1]),
+            start_date=str(start_date),
+            last_date=str(last_date),
             done=0,
             error=0,
             collection_item=count_items
         )
 
     @classmethod
-    def list_tiles_cube(cls, cube_id: int, only_ids=False):
-        """Retrieve all tiles (as GeoJSON) that belongs to a data cube."""
-        features = db.session.query(
-            Item.tile_id,
-            Tile,
-            func.ST_AsGeoJSON(Item.bbox, 6, 3).cast(sqlalchemy.JSON).label('geom')
-        ).distinct(Item.tile_id).filter(Item.collection_id == cube_id, Item.tile_id == Tile.id).all()
+    def list_tiles_cube(cls, cube_id: int, only_ids=False, limit: int = None):
+        """Retrieve all tiles (as GeoJSON) that belongs to a data cube.
+
+        Args:
+            cube_id (int): Data cube identifier
+            only_ids (bool): Retrieve only the tile names, skipping the geometry serialization in database.
+            limit (int): Maximum number of tiles to retrieve. Defaults to ``None``, which means all tiles.
+        """
+        columns = [Tile.name.label('tile')]
+        if not only_ids:
+            columns.append(func.ST_AsGeoJSON(Item.bbox, 6, 3).cast(sqlalchemy.JSON).label('geom'))
+
+        query = (
+            db.session.query(*columns)
+            .select_from(Item)
+            .join(Tile, Tile.id == Item.tile_id)
+            .distinct(Item.tile_id)
+            .filter(Item.collection_id == cube_id)
+        )
+
+        if limit is not None:
+            query = query.limit(limit)
+
+        features = query.all()
 
-        return [feature.Tile.name if only_ids else feature.geom for feature in features], 200
+        return [feature.tile if only_ids else feature.geom for feature in features], 200
 
     @classmethod
     def check_for_invalid_merges(cls, cube_id: str, tile_id: str, start_date: str,
@@ -475,7 +618,7 @@ class CubeController:
         periods = Timeline(schema, start_date, last_date, unit, int(step), cycle, intervals).mount()
 
         return dict(
-            timeline=[[str(period[0]), str(period[1])] for period in periods]
+            timeline=[(start.isoformat(), end.isoformat()) for start, end in periods]
         )
 
     @classmethod
@@ -498,6 +641,7 @@ class CubeController:
         return response, 200
 
     @classmethod
+    @ttl_cache(30)
     def list_grs_schemas(cls):
         """Retrieve a list of available Grid Schema on Brazil Data Cube database."""
         schemas = GridRefSys.query().all()
@@ -516,10 +660,9 @@ class CubeController:
         srid_column = get_srid_column(geom_table.c, default_srid=4326)
         where = []
         if bbox is not None:
-            x_min, y_min, x_max, y_max = bbox
             where.append(
                 func.ST_Intersects(
-                    func.ST_MakeEnvelope(x_min, y_min, x_max, y_max, 4326),
+                    _make_envelope(bbox),
                     func.ST_Transform(func.ST_SetSRID(geom_table.c.geom, srid_column), 4326)
                 )
             )
@@ -550,19 +693,19 @@ class CubeController:
                                            bbox=bbox, srid=srid,
                                            tile_factor=tile_factor)
 
+        crs = CRS.from_proj4(proj4)
+        data = dict(
+            auth_name='Albers Equal Area',
+            auth_srid=srid,
+            srid=srid,
+            srtext=crs.to_wkt(),
+            proj4text=proj4
+        )
+
         for name in names:
             grid = grid_mapping[name]
 
             with db.session.begin_nested():
-                crs = CRS.from_proj4(proj4)
-                data = dict(
-                    auth_name='Albers Equal Area',
-                    auth_srid=srid,
-                    srid=srid,
-                    srtext=crs.to_wkt(),
-                    proj4text=proj4
-                )
-
                 spatial_index, _ = get_or_create_model(SpatialRefSys, defaults=data, srid=srid)
 
                 try:
@@ -572,13 +715,20 @@ class CubeController:
                 except RuntimeError:
                     abort(409, f'GRS / Table {name} already exists.')
 
-                grs.description = description
-                db.session.add(grs)
-                for tile_obj in grid['tiles']:
-                    tile = Tile(**tile_obj, grs=grs)
-                    db.session.add(tile)
+                # Control the flush boundary: flush once to generate the grid identifier
+                # and then bulk insert the tiles without any unit-of-work processing.
+                with db.session.no_autoflush:
+                    grs.description = description
+                    db.session.add(grs)
+                    db.session.flush()
+
+                    tiles = [dict(**tile_obj, grid_ref_sys_id=grs.id) for tile_obj in grid['tiles']]
+                    if tiles:
+                        db.session.execute(sqlalchemy.insert(Tile), tiles)
             db.session.commit()
 
+        cls.list_grs_schemas.cache_clear()
+
         return 'Grids {} created with successfully'.format(names), 201
 
     @classmethod
@@ -588,8 +738,7 @@ class CubeController:
         _ = cls.get_cube_or_404(cube_id=cube_id)
 
         where = [
-            Item.collection_id == cube_id,
-            Tile.id == Item.tile_id
+            Item.collection_id == cube_id
         ]
 
         # temporal filter
@@ -607,23 +756,38 @@ class CubeController:
 
         # spatial filter
         if bbox:
-            xmin, ymin, xmax, ymax = [float(coord) for coord in bbox.split(',')]
             where.append(
                 func.ST_Intersects(
-                    func.ST_SetSRID(Item.bbox, 4326), func.ST_MakeEnvelope(xmin, ymin, xmax, ymax, 4326)
+                    func.ST_SetSRID(Item.bbox, 4326), _make_envelope(bbox.split(','))
                 )
             )
 
-        paginator = db.session.query(Item).filter(
-            *where
-        ).order_by(Item.start_date.desc()).paginate(page=int(page), per_page=int(per_page), error_out=False)
+        page = max(int(page), 1)
+        per_page = int(per_page)
+
+        # Retrieve the tile name along the item to avoid lazy loading "item.tile" per row
+        query = (
+            db.session.query(Item, Tile.name.label('tile_name'))
+            .join(Tile, Tile.id == Item.tile_id)
+            .filter(*where)
+        )
+
+        total_items = query.count()
+
+        rows = (
+            query
+            .order_by(Item.start_date.desc())
+            .limit(per_page)
+            .offset((page - 1) * per_page)
+            .all()
+        )
 
         result = []
-        for item in paginator.items:
+        for item, tile_name in rows:
             obj = Serializer.serialize(item)
             obj['bbox'] = None
             obj['footprint'] = None
-            obj['tile_id'] = item.tile.name
+            obj['tile_id'] = tile_name
             if item.assets.get('thumbnail'):
                 obj['quicklook'] = item.assets['thumbnail']['href']
             del obj['assets']
@@ -634,11 +798,12 @@ class CubeController:
             items=result,
             page=page,
             per_page=page,
-            total_items=paginator.total,
-            total_pages=paginator.pages
+            total_items=total_items,
+            total_pages=math.ceil(total_items / per_page) if per_page > 0 else 0
         ), 200
 
     @classmethod
+    @ttl_cache(30)
     def list_composite_functions(cls):
         """Retrieve a list of available Composite Functions on Brazil Data Cube database."""
         schemas = CompositeFunction.query().all()
@@ -664,13 +829,12 @@ class CubeController:
         cube_parameters, _ = get_or_create_model(CubeParameters, defaults=defaults, collection_id=cube.id)
 
         with db.session.begin_nested():
-            # We must create a new copy to make effect in SQLAlchemy
-            meta = deepcopy(cube_parameters.metadata_)
-            meta.update(**kwargs)
-            cube_parameters.metadata_ = meta
+            # The column is a MutableDict, so in-place changes are tracked by SQLAlchemy.
+            cube_parameters.metadata_.update(kwargs)
             db.session.add(cube_parameters)
 
         db.session.commit()
+        cls._clear_cube_cache()
 
         return Serializer.serialize(cube_parameters)
 
@@ -747,11 +911,58 @@ class CubeController:
         return {"process_id": result.id, "status": "scheduled"}
 
 
+def _make_envelope(bbox: Sequence[Union[str, float]], srid: int = 4326):
+    """Build a PostGIS envelope from bounding box using typed bind parameters.
+
+    The named parameters keep the same SQL statement for every bounding box, which
+    allows the database to reuse the statement plan.
+    """
+    xmin, ymin, xmax, ymax = bbox
+    return func.ST_MakeEnvelope(
+        sqlalchemy.bindparam('xmin', float(xmin), type_=sqlalchemy.Float),
+        sqlalchemy.bindparam('ymin', float(ymin), type_=sqlalchemy.Float),
+        sqlalchemy.bindparam('xmax', float(xmax), type_=sqlalchemy.Float),
+        sqlalchemy.bindparam('ymax', float(ymax), type_=sqlalchemy.Float),
+        srid
+    )
+
+
+def _default_band_attributes(function: str, params: dict) -> List[dict]:
+    """Retrieve the attributes of the default bands (ClearOb, TotalOb, etc) required by the composite function."""
+    attributes = []
+
+    if function != constants.IDENTITY:
+        attributes.append(constants.CLEAR_OBSERVATION_ATTRIBUTES)
+        attributes.append(constants.TOTAL_OBSERVATION_ATTRIBUTES)
+
+        if function in ('STK', 'LCF'):
+            attributes.append(constants.PROVENANCE_ATTRIBUTES)
+
+    if params.get('is_combined') and function != 'MED':
+        attributes.append(constants.DATASOURCE_ATTRIBUTES)
+
+    return attributes
+
+
+def _clone_band_metadata(metadata: dict) -> dict:
+    """Copy the band metadata, only rebuilding the parts changed by ``_validate_band_metadata``."""
+    out = dict(metadata)
+    out['expression'] = {**metadata['expression'], 'bands': list(metadata['expression']['bands'])}
+    return out
+
+
 def _make_item_assets(cube: Collection) -> dict:
     definition = {}
-    for band in cube.bands:
+    bands = cube.bands
+    # Resolve all the band mime types at once instead of lazy loading per band.
+    mime_type_ids = {band.mime_type_id for band in bands}
+    mime_types = dict(
+        db.session.query(MimeType.id, MimeType.name).filter(MimeType.id.in_(mime_type_ids)).all()
+    ) if mime_type_ids else dict()
+
+    for band in bands:
         definition[band.name] = dict(
-            type=band.mime_type.name,
+            type=mime_types.get(band.mime_type_id),
             title=band.description or f'Band {band.name}',
             roles=['data'],
         )
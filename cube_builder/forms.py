@@ -19,7 +19,14 @@
 
 """Define Cube Builder forms used to validate both data input and data serialization."""
 
+import json
+import pkgutil
+from functools import lru_cache
+
+import bdc_catalog
 from bdc_catalog.models import Band, Collection, GridRefSys, db
+from jsonschema import draft7_format_checker
+from jsonschema.validators import validator_for
 from marshmallow import Schema, fields, pre_load, validate
 from marshmallow.validate import OneOf, Regexp, ValidationError
 from marshmallow_sqlalchemy import auto_field
@@ -29,6 +36,19 @@ from rasterio.dtypes import dtype_ranges
 from cube_builder.constants import IDENTITY
 
 
+@lru_cache()
+def _temporal_schema_validator():
+    """Build the validator of ``temporal_schema`` only once, since loading and checking the schema is expensive."""
+    content = pkgutil.get_data(bdc_catalog.__name__, 'jsonschemas/collection-temporal-composition-schema.json')
+    schema = json.loads(content)
+    schema['$id'] = schema['$id'].replace('#', '')
+
+    validator_cls = validator_for(schema)
+    validator_cls.check_schema(schema)
+
+    return validator_cls(schema, format_checker=draft7_format_checker)
+
+
 class CollectionForm(SQLAlchemyAutoSchema):
     """Form definition for Model Collection."""
 
@@ -81,6 +101,8 @@ class BandForm(SQLAlchemyAutoSchema):
 
 INVALID_CUBE_NAME = 'Invalid data cube name. Expected only letters and numbers.'
 SUPPORTED_DATA_TYPES = list(dtype_ranges.keys())
+# Ordered mapping of the supported data types, used by OneOf for constant time membership tests.
+_SUPPORTED_DATA_TYPES_LOOKUP = dict.fromkeys(SUPPORTED_DATA_TYPES)
 
 
 class BandDefinition(Schema):
@@ -88,7 +110,7 @@ class BandDefinition(Schema):
 
     name = fields.String(required=True, allow_none=False)
     common_name = fields.String(required=True, allow_none=False)
-    data_type = fields.String(required=True, allow_none=False, validate=OneOf(SUPPORTED_DATA_TYPES))
+    data_type = fields.String(required=True, allow_none=False, validate=OneOf(_SUPPORTED_DATA_TYPES_LOOKUP))
     nodata = fields.Float(required=False, allow_none=False)
     metadata = fields.Dict(required=False, allow_none=False)
 
@@ -177,37 +199,23 @@ class DataCubeForm(Schema):
         Raises:
             ValidationError when a band inside indexes or quality_band is duplicated with attribute bands.
         """
-        indexes = data['indexes']
-
-        band_names = [b['name'] for b in data['bands']]
+        bands_by_name = {b['name']: b for b in data['bands']}
 
-        for band_index in indexes:
-            if band_index['name'] in band_names:
+        for band_index in data['indexes']:
+            if band_index['name'] in bands_by_name:
                 raise ValidationError(f'Duplicated band name in indices {band_index["name"]}')
 
         if data['composite_function'] != IDENTITY and data.get('quality_band') is None:
             raise ValidationError(f'Quality band is required for {data["composite_function"]}.')
 
         if 'quality_band' in data and data.get('quality_band') is not None:
-            if data['quality_band'] not in band_names:
+            if data['quality_band'] not in bands_by_name:
                 raise ValidationError(f'Quality band "{data["quality_band"]}" not found in key "bands"')
 
-            band = next(filter(lambda band: band['name'] == data['quality_band'], data['bands']))
-            band['common_name'] = 'quality'
+            bands_by_name[data['quality_band']]['common_name'] = 'quality'
 
         if 'temporal_schema' in data:
-            import json
-            import pkgutil
-
-            import bdc_catalog
-            from jsonschema import draft7_format_checker, validate
-            content = pkgutil.get_data(bdc_catalog.__name__, 'jsonschemas/collection-temporal-composition-schema.json')
-            schema = json.loads(content)
-            try:
-                schema['$id'] = schema['$id'].replace('#', '')
-                validate(instance=data['temporal_schema'], schema=schema, format_checker=draft7_format_checker)
-            except Exception as e:
-                raise
+            _temporal_schema_validator().validate(data['temporal_schema'])
 
         return data
 
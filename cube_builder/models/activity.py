@@ -23,7 +23,8 @@ from typing import Union
 
 from bdc_catalog.models.base_sql import BaseModel, db
 # 3rdparty
-from sqlalchemy import ARRAY, JSON, Column, Date, Index, Integer, String, Text, text
+from sqlalchemy import ARRAY, Column, Date, Index, Integer, String, Text, bindparam, cast, func, select
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.engine import ResultProxy
 
 from ..config import Config
@@ -42,7 +43,7 @@ class Activity(BaseModel):
     date = Column(Date, nullable=False)
     tile_id = Column(String, nullable=False)
     status = Column(String(64), nullable=False)
-    args = Column('args', JSON)
+    args = Column('args', JSONB)
     tags = Column('tags', ARRAY(String))
     scene_type = Column('scene_type', String)
     band = Column('band', String(64), nullable=False)
@@ -53,8 +54,9 @@ class Activity(BaseModel):
         Index(None, date),
         Index(None, band),
         Index(None, status),
-        Index(None, collection_id),
-        Index(None, warped_collection_id),
+        # Match the filters of ``list_merge_files``. They also cover the lookups by collection only.
+        Index('idx_cube_builder_activities_collection_id_tile_id_date', collection_id, tile_id, date),
+        Index('idx_cube_builder_activities_warped_collection_id_tile_id_date', warped_collection_id, tile_id, date),
         {"schema": Config.ACTIVITIES_SCHEMA}
     )
 
@@ -62,27 +64,42 @@ class Activity(BaseModel):
     def list_merge_files(cls, collection: str, tile: str,
                          start_date: Union[str, datetime],
                          end_date: Union[str, datetime],
-                         identity: bool = False) -> ResultProxy:
-        """List all merge files used in data cube generation."""
-        field = 'collection_id'
-        if identity:
-            field = 'warped_collection_id'
-        sql = """
-        SELECT id, tile_id, band, date::VARCHAR as date, collection_id, args->>'file' AS file, args->'dataset'::VARCHAR AS data_set, (elem->>'link')::VARCHAR as link, status, traceback::TEXT
-          FROM cube_builder.activities
-         CROSS JOIN json_array_elements(args->'assets') elem
-         WHERE {} = '{}'
-           AND tile_id = '{}'
-           AND date BETWEEN '{}'::DATE AND '{}'::DATE
-         ORDER BY id
-        """.format(
-            field,
-            collection,
-            tile,
-            start_date,
-            end_date
-        )
-
-        res = db.session.execute(text(sql))
-
-        return res.fetchall()
+                         identity: bool = False, yield_per: int = 1000) -> ResultProxy:
+        """List all merge files used in data cube generation.
+
+        The rows are streamed from a server side cursor in batches of ``yield_per`` rows
+        instead of being fetched all at once. Use ``list()`` when the rows must be materialized.
+        """
+        field = 'warped_collection_id' if identity else 'collection_id'
+
+        params = dict(collection=collection, tile=tile, start_date=start_date, end_date=end_date)
+
+        statement = _LIST_MERGE_FILES_STATEMENTS[field].execution_options(stream_results=True)
+
+        res = db.session.execute(statement, params)
+
+        return res.yield_per(yield_per)
+
+
+def _list_merge_files_statement(field: str):
+    """Build the statement of ``Activity.list_merge_files`` filtering the collection by ``field``."""
+    table = Activity.__table__
+    asset = func.jsonb_array_elements(table.c.args['assets'], type_=JSONB).column_valued('elem')
+
+    return (
+        select(table.c.id, table.c.tile_id, table.c.band, cast(table.c.date, String).label('date'),
+               table.c.collection_id, table.c.args['file'].astext.label('file'),
+               table.c.args['dataset'].label('data_set'), asset['link'].astext.label('link'),
+               table.c.status, cast(table.c.traceback, Text).label('traceback'))
+        .where(table.c[field] == bindparam('collection'),
+               table.c.tile_id == bindparam('tile'),
+               table.c.date.between(cast(bindparam('start_date'), Date), cast(bindparam('end_date'), Date)))
+        .order_by(table.c.id)
+    )
+
+
+_LIST_MERGE_FILES_STATEMENTS = {
+    field: _list_merge_files_statement(field)
+    for field in ('collection_id', 'warped_collection_id')
+}
+"""Statements used by ``Activity.list_merge_files``, built once with bound parameters."""
@@ -21,6 +21,7 @@
 import sqlalchemy as sa
 from bdc_catalog.models import Collection
 from bdc_catalog.models.base_sql import BaseModel
+from sqlalchemy.ext.mutable import MutableDict
 from sqlalchemy.orm import relationship
 
 from cube_builder.config import Config
@@ -35,7 +36,7 @@ class CubeParameters(BaseModel):
     id = sa.Column(sa.Integer, primary_key=True)
     collection_id = sa.Column(sa.ForeignKey(Collection.id, onupdate='CASCADE', ondelete='CASCADE'),
                               nullable=False)
-    metadata_ = sa.Column(sa.JSON, default='{}', nullable=False)
+    metadata_ = sa.Column(MutableDict.as_mutable(sa.JSON), default='{}', nullable=False)
 
     cube = relationship(Collection, lazy='select')
 
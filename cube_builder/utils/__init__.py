@@ -18,6 +18,9 @@
 
 """Cube Builder utilities."""
 
+import threading
+import time
+from functools import wraps
 from typing import List
 
 import geoalchemy2
@@ -51,3 +54,43 @@ def _is_srid_column(column: Column):
             if 'spatial_ref_sys.srid' in fk.target_fullname:
                 return True
     return False
+
+
+def ttl_cache(ttl: float):
+    """Cache the results of a function for ``ttl`` seconds.
+
+    It is meant for lookups that rarely change, like the list of grids. The cached values are shared between
+    the calls, so they must not be changed. Use ``func.cache_clear()`` to drop the values before they expire.
+
+    Args:
+        ttl (float): Time in seconds to keep a result.
+    """
+    def decorator(func):
+        cache = dict()
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+            with lock:
+                entry = cache.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+
+            result = func(*args, **kwargs)
+            with lock:
+                # Drop the expired results, so the arguments which are not requested anymore do not pile up
+                for expired in [k for k, (expires, _) in cache.items() if expires <= now]:
+                    del cache[expired]
+                cache[key] = (now + ttl, result)
+            return result
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
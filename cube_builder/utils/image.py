@@ -649,17 +649,34 @@ def rescale(array: ArrayType, multiplier: float, new_scale: float,
                    [14221.425, -1438.725,  -363.75 ]])
     """
     dtype = dtype or array.dtype
-    array = (array * multiplier) + origin_additive
-
     data_type_info = numpy.iinfo(dtype)
 
-    data_type_max_value = data_type_info.max
-    data_type_min_value = data_type_info.min
+    mask = None
+    if isinstance(array, numpy.ma.MaskedArray):
+        mask = numpy.ma.getmaskarray(array)
+        # Same as numpy.ma arithmetic, the masked arrays are scaled in double precision
+        data = numpy.multiply(array.data, multiplier, dtype=numpy.float64)
+    else:
+        data = numpy.multiply(array, multiplier)
+        if not numpy.issubdtype(data.dtype, numpy.floating):
+            data = data.astype(numpy.float64)
+
+    # A single float buffer is allocated and the remaining operations are applied in place
+    data += origin_additive
+    numpy.clip(data, data_type_info.min, data_type_info.max, out=data)
+    data /= new_scale
+
+    result = data.astype(dtype)
+
+    if mask is None:
+        return result
 
-    array[array < data_type_min_value] = data_type_min_value
-    array[array > data_type_max_value] = data_type_max_value
+    # Keep the original values (like nodata) under the mask, only limited to the data type range
+    masked_values = array.data[mask].astype(numpy.float64)
+    numpy.clip(masked_values, data_type_info.min, data_type_info.max, out=masked_values)
+    result[mask] = masked_values
 
-    return (array / new_scale).astype(dtype)
+    return numpy.ma.masked_array(result, mask=mask)
 
 
 def raster_convexhull(imagepath: str, epsg='EPSG:4326') -> dict:
@@ -710,7 +727,8 @@ def raster_extent(imagepath: str, epsg = 'EPSG:4326') -> shapely.geometry.Polygo
 
 def linear_raster_scale(array: ArrayType,
                         input_range: Tuple[int, int],
-                        output_range: Tuple[int, int] = (0, 255)) -> ArrayType:
+                        output_range: Tuple[int, int] = (0, 255),
+                        out: numpy.ndarray = None) -> ArrayType:
     """Clip the values in an array and apply linear rescaling.
 
     Note:
@@ -721,20 +739,36 @@ def linear_raster_scale(array: ArrayType,
         array (ArrayType): Input raster
         input_range: The array min and max values
         output_range: The output min and max values to rescale to. Defaults to ``0, 255``.
+        out (numpy.ndarray): Optional float buffer with the same shape of array to write the result,
+            which lets callers reuse it between calls.
 
     Returns:
         ArrayType: scaled array (in float)
     """
-    clip = numpy.clip
+    mask = None
+    float_type = numpy.float32
     if isinstance(array, numpy.ma.MaskedArray):
-        clip = numpy.ma.clip
-
-    data = clip(array, input_range[0], input_range[1]) - input_range[0]
-    data = data / numpy.float32(input_range[1] - input_range[0])
-
-    data = data * (output_range[1] - output_range[0]) + output_range[0]
-
-    return data
+        # Masked arrays are scaled in double precision, like numpy.ma arithmetic does
+        mask = numpy.ma.getmaskarray(array)
+        array = array.data
+        float_type = numpy.float64
+
+    if out is None:
+        out = numpy.empty(array.shape, dtype=numpy.result_type(array.dtype, float_type))
+
+    # As numpy.ma does, the invalid operations are not reported for masked arrays
+    errors = dict(divide='ignore', invalid='ignore') if mask is not None else dict()
+    with numpy.errstate(**errors):
+        numpy.clip(array, input_range[0], input_range[1], out=out)
+        out -= input_range[0]
+        out /= numpy.float32(input_range[1] - input_range[0])
+        out *= output_range[1] - output_range[0]
+        out += output_range[0]
+
+    if mask is not None:
+        return numpy.ma.masked_array(out, mask=mask)
+
+    return out
 
 
 def get_resample_method(name: str) -> Resampling:
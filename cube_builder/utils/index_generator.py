@@ -18,26 +18,131 @@
 
 """Simple data cube band generator."""
 
+import ast
 import logging
-from typing import Dict, List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import numpy
+import rasterio
 from bdc_catalog.models import Band, Collection
 
+from ..config import Config
 from .image import SmartDataSet, generate_cogs
-from .interpreter import execute
+from .interpreter import compile_expression, execute
+
+try:
+    import numexpr
+except ImportError:  # pragma: no cover
+    numexpr = None
 
 BandMapFile = Dict[str, str]
 """Type which a key (represented as data cube band name) points to generated file in disk."""
 
 
+def _compile_numexpr(expression: str, band_names: Sequence[str]) -> Optional[Tuple[object, List[str]]]:
+    """Try to compile the band expression with `numexpr <https://github.com/pydata/numexpr>`_.
+
+    The numexpr evaluates the whole expression in chunks without the intermediate arrays,
+    but it only supports single arithmetic expressions. Install it with the extra ``numexpr``.
+
+    Returns:
+        The compiled expression and the band names in the argument order.
+        ``None`` when numexpr is not installed or when the expression is not supported.
+    """
+    if numexpr is None:
+        return None
+
+    try:
+        variables = {node.id for node in ast.walk(ast.parse(expression, mode='eval')) if isinstance(node, ast.Name)}
+        names = [name for name in band_names if name in variables]
+
+        # The numexpr kind of the Python type float is the single precision, matching the float32 buffers
+        return numexpr.NumExpr(expression, signature=[(name, float) for name in names]), names
+    except Exception as e:
+        logging.debug(f'Expression {expression} not supported by numexpr, using Python interpreter: {e}')
+        return None
+
+
+class _ThreadDataSets(threading.local):
+    """Hold the input data sets and read buffers of each worker thread.
+
+    A rasterio data set must not be shared between threads, so each thread opens its own handles.
+    The opened data sets are registered in ``opened`` in order to be closed by the caller.
+
+    Since the GDAL options of ``rasterio.Env`` are thread local, the data sets are opened
+    within an environment configured with ``env_options``.
+    """
+
+    def __init__(self, scenes: BandMapFile, opened: List[SmartDataSet], lock: threading.Lock, env_options: dict):
+        """Open the scenes data sets for the current thread."""
+        with rasterio.Env(**env_options):
+            self.datasets = {band_name: SmartDataSet(str(file_path), mode='r')
+                             for band_name, file_path in scenes.items()}
+        self.buffers = dict()
+
+        with lock:
+            opened.extend(self.datasets.values())
+
+
+def _process_window(window, thread_data: _ThreadDataSets, band_name: str, expression, data_type: str,
+                    data_type_range: Tuple[int, int], nodata: float,
+                    fast_expression: Optional[Tuple[object, List[str]]] = None):
+    """Evaluate the band expression over a block window and cast it to the band data type.
+
+    The input nodata values are read as ``NaN``, which propagates through the expression
+    without the ``numpy.ma`` overhead. Any non finite result is written as ``nodata``.
+
+    When ``fast_expression`` (from :func:`_compile_numexpr`) is given, it is used instead of ``expression``.
+    """
+    shape = window.height, window.width
+    machine_context = dict()
+
+    # Single stacked buffer with all the input bands of the window, reused between windows of same shape.
+    stack = thread_data.buffers.get(shape)
+    if stack is None:
+        stack = thread_data.buffers[shape] = numpy.empty((len(thread_data.datasets), *shape), dtype=numpy.float32)
+
+    for position, (k, ds) in enumerate(thread_data.datasets.items()):
+        # Read straight into the float32 buffer, skipping the intermediate array and cast copy.
+        band = ds.dataset.read(1, window=window, out=stack[position])
+
+        if ds.dataset.nodata is not None:
+            numpy.putmask(band, band == ds.dataset.nodata, numpy.nan)
+
+        machine_context[k] = band
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        if fast_expression is not None:
+            compiled_expression, names = fast_expression
+            raster = compiled_expression(*(machine_context[name] for name in names))
+        else:
+            result = execute(expression, context=machine_context)
+            raster = result[band_name]
+
+    invalid = ~numpy.isfinite(raster)
+
+    # Persist the expected band data type to cast value safely.
+    # TODO: Should we use consider band min_value/max_value?
+    # Clip in place to avoid allocating the temporary boolean masks
+    numpy.clip(raster, *data_type_range, out=raster)
+    numpy.putmask(raster, invalid, nodata)
+
+    return window, raster.astype(data_type)
+
+
 def generate_band_indexes(cube: Collection, scenes: dict, period: str, tile_id: str, reuse_data_cube: Collection = None,
-                          **kwargs) -> BandMapFile:
+                          num_threads: int = Config.MAX_THREADS_BAND_INDEX, **kwargs) -> BandMapFile:
     """Generate data cube custom bands based in string-expression on table `band_indexes`.
 
     This method seeks for custom bands on Collection Band definition. A custom band must have
     `metadata` property filled out according the ``bdc_catalog.jsonschemas.band-metadata.json``.
 
+    The block windows are processed concurrently by ``num_threads`` threads, each one with its own
+    data set handles. The output is written by the calling thread only.
+
     Note:
         When collection does not have any index band, returns empty dict.
 
@@ -47,7 +152,7 @@ def generate_band_indexes(cube: Collection, scenes: dict, period: str, tile_id:
     Returns:
         A dict values with generated bands.
     """
-    from .processing import build_cube_path
+    from .processing import build_cube_path, get_rasterio_config
 
     cube_band_indexes: List[Band] = []
 
@@ -58,70 +163,82 @@ def generate_band_indexes(cube: Collection, scenes: dict, period: str, tile_id:
     if not cube_band_indexes:
         return dict()
 
-    map_data_set_context = dict()
-    profile = None
-    blocks = []
+    env_options = get_rasterio_config()
+    opened_datasets = []
 
-    for band_name, file_path in scenes.items():
-        map_data_set_context[band_name] = SmartDataSet(str(file_path), mode='r')
+    try:
+        # Set up the GDAL environment once for the whole generation instead of on each data set operation
+        with rasterio.Env(**env_options):
+            # The calling thread data sets are also used to retrieve the profile and block windows
+            thread_data = _ThreadDataSets(scenes, opened_datasets, threading.Lock(), env_options)
+            profile = None
+            blocks = []
 
-        if profile is None:
-            profile = map_data_set_context[band_name].dataset.profile.copy()
-            blocks = list(map_data_set_context[band_name].dataset.block_windows())
+            for data_set in thread_data.datasets.values():
+                profile = data_set.dataset.profile.copy()
+                blocks = list(data_set.dataset.block_windows())
+                break
 
-    if not blocks or profile is None:
-        raise RuntimeError('Can\t generate band indexes since profile/blocks is None.')
+            if not blocks or profile is None:
+                raise RuntimeError('Can\t generate band indexes since profile/blocks is None.')
 
-    output = dict()
-    cube_name = cube.name
-    cube_version = cube.version
-    if reuse_data_cube:
-        cube_name = reuse_data_cube['name']
-        cube_version = reuse_data_cube['version']
+            output = dict()
+            cube_name = cube.name
+            cube_version = cube.version
+            if reuse_data_cube:
+                cube_name = reuse_data_cube['name']
+                cube_version = reuse_data_cube['version']
 
-    for band_index in cube_band_indexes:
-        band_name = band_index.name
+            windows = [window for _, window in blocks]
 
-        band_expression = band_index.metadata_['expression']['value']
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                for band_index in cube_band_indexes:
+                    band_name = band_index.name
 
-        band_data_type = band_index.data_type
+                    band_expression = band_index.metadata_['expression']['value']
 
-        data_type_info = numpy.iinfo(band_data_type)
+                    band_data_type = band_index.data_type
 
-        data_type_max_value = data_type_info.max
-        data_type_min_value = data_type_info.min
+                    data_type_info = numpy.iinfo(band_data_type)
 
-        profile['dtype'] = band_data_type
-        profile['nodata'] = float(band_index.nodata)
+                    profile['dtype'] = band_data_type
+                    profile['nodata'] = float(band_index.nodata)
 
-        custom_band_path = build_cube_path(cube_name, period, tile_id, version=cube_version, band=band_name,
-                                           **kwargs)
+                    custom_band_path = build_cube_path(cube_name, period, tile_id, version=cube_version, band=band_name,
+                                                       **kwargs)
 
-        output_dataset = SmartDataSet(str(custom_band_path), mode='w', **profile)
-        logging.info(f'Generating band {band_name} for cube {cube_name} - {custom_band_path.stem}...')
+                    output_dataset = SmartDataSet(str(custom_band_path), mode='w', **profile)
+                    logging.info(f'Generating band {band_name} for cube {cube_name} - {custom_band_path.stem}...')
 
-        for _, window in blocks:
-            machine_context = {
-                k: ds.dataset.read(1, masked=True, window=window).astype(numpy.float32)
-                for k, ds in map_data_set_context.items()
-            }
+                    # Parse and compile the band expression only once for all the windows
+                    compiled_expression = compile_expression(f'{band_name} = {band_expression}')
+                    fast_expression = _compile_numexpr(band_expression, list(scenes))
 
-            expr = f'{band_name} = {band_expression}'
-
-            result = execute(expr, context=machine_context)
-            raster = result[band_name]
+                    process_window = partial(_process_window, thread_data=thread_data, band_name=band_name,
+                                             expression=compiled_expression, data_type=band_data_type,
+                                             data_type_range=(data_type_info.min, data_type_info.max),
+                                             nodata=profile['nodata'], fast_expression=fast_expression)
 
-            # Persist the expected band data type to cast value safely.
-            # TODO: Should we use consider band min_value/max_value?
-            raster[raster < data_type_min_value] = data_type_min_value
-            raster[raster > data_type_max_value] = data_type_max_value
+                    # The windows are already processed in parallel, so numexpr runs single threaded in the pool
+                    numexpr_threads = None
+                    if fast_expression is not None and num_threads > 1:
+                        numexpr_threads = numexpr.set_num_threads(1)
 
-            output_dataset.dataset.write(raster.astype(band_data_type), window=window, indexes=1)
+                    try:
+                        for window, raster in executor.map(process_window, windows):
+                            output_dataset.dataset.write(raster, window=window, indexes=1)
+                    finally:
+                        if numexpr_threads is not None:
+                            numexpr.set_num_threads(numexpr_threads)
 
-        output_dataset.close()
+                    output_dataset.close()
 
-        generate_cogs(str(custom_band_path), str(custom_band_path))
+                    generate_cogs(str(custom_band_path), str(custom_band_path))
 
-        output[band_name] = str(custom_band_path)
+                    output[band_name] = str(custom_band_path)
+    finally:
+        # The data sets of all the threads are closed also when the generation fails
+        for dataset in opened_datasets:
+            dataset.close()
 
     return output
@@ -19,13 +19,31 @@
 """Simple abstraction of Python Interpreter."""
 
 import ast
-from typing import Any, Dict
+from types import CodeType
+from typing import Any, Dict, Union
 
 # Type for Python Execution Code Context.
 ExecutionContext = Dict[str, Any]
 
 
-def execute(expression: str, context: dict) -> ExecutionContext:
+def compile_expression(expression: str) -> CodeType:
+    """Parse and compile a string expression into a Python code object.
+
+    Use it to compile the expression once and then :func:`execute` it several times,
+    like while processing a raster window by window.
+
+    Examples:
+        >>> import numpy
+        >>> code = compile_expression('coastalHalf = B1 / 2')
+        >>> for _ in range(2):
+        ...     res = execute(code, context=dict(B1=numpy.random.rand(10, 10) * 10000))
+    """
+    ast_expression = ast.parse(expression)
+
+    return compile(ast_expression, '<ast>', 'exec')
+
+
+def execute(expression: Union[str, CodeType], context: dict) -> ExecutionContext:
     """Evaluate a string expression as Python object and execute in Python Interpreter.
 
     This method allows to execute dynamic expression into a Python Virtual Machine.
@@ -36,7 +54,7 @@ def execute(expression: str, context: dict) -> ExecutionContext:
      internal issues.
 
      Args:
-         expression - String-like python expression
+         expression - String-like python expression or code object from :func:`compile_expression`
          context - Context loaded variables
 
     Examples:
@@ -51,9 +69,9 @@ def execute(expression: str, context: dict) -> ExecutionContext:
     Returns:
         Map of context values loaded in memory.
     """
-    ast_expression = ast.parse(expression)
-
-    compiled_expression = compile(ast_expression, '<ast>', 'exec')
+    compiled_expression = expression
+    if isinstance(expression, str):
+        compiled_expression = compile_expression(expression)
 
     exec(compiled_expression, context)
 
@@ -19,15 +19,21 @@
 """Define celery tasks utilities for datacube generation."""
 
 # Python Native
+import atexit
 import logging
+import os
 import shutil
+import threading
 import warnings
-from contextlib import contextmanager
-from copy import deepcopy
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from copy import copy
 from datetime import datetime
+from functools import lru_cache, partial
 from pathlib import Path
-from tempfile import TemporaryDirectory
-from typing import List, Tuple, Union
+from tempfile import mkstemp
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
 
 # 3rdparty
 import numpy
@@ -38,8 +44,10 @@ import requests
 from bdc_catalog.models import Collection, Item, SpatialRefSys, Tile, db
 from geoalchemy2.shape import from_shape, to_shape
 from numpngw import write_png
-from rasterio import Affine, MemoryFile
+from rasterio import Affine
+from rasterio.vrt import WarpedVRT
 from rasterio.warp import Resampling, reproject
+from requests.adapters import HTTPAdapter
 from sqlalchemy import func
 
 from ..config import Config
@@ -47,7 +55,7 @@ from ..config import Config
 from ..constants import (CLEAR_OBSERVATION_ATTRIBUTES, CLEAR_OBSERVATION_NAME, COG_MIME_TYPE, DATASOURCE_ATTRIBUTES,
                          DATASOURCE_NAME, PROVENANCE_ATTRIBUTES, PROVENANCE_NAME, SRID_ALBERS_EQUAL_AREA,
                          TOTAL_OBSERVATION_NAME)
-from ..drivers.datasets import dataset_from_uri
+from ..drivers.datasets import DataSet, dataset_from_uri
 # Builder
 from . import get_srid_column
 from .image import (SmartDataSet, generate_cogs, get_resample_method, linear_raster_scale, raster_convexhull,
@@ -57,14 +65,25 @@ from .strings import StringFormatter
 
 FORMATTER = StringFormatter()
 
+DEFAULT_FORMAT_PATH_CUBE = '{prefix}/{folder}/{datacube:lower}/{version}/{path}/{row}/{year}/{month}/{day}/{filename}'
+"""Default template for data cube file paths. See :func:`build_cube_path`."""
+DEFAULT_FORMAT_ITEM_CUBE = '{datacube:upper}_V{version}_{tile_id}_{start_date}'
+"""Default template for data cube item identifiers. See :func:`get_item_id`."""
+
 Limit = Tuple[int, int]
 """Represent the type for Image range."""
 ChannelLimits = Tuple[Limit, Limit, Limit]
 """Represent the band channels (R, G, B) for quick look generation."""
 
 
+@lru_cache(maxsize=1)
 def get_rasterio_config() -> dict:
-    """Retrieve cube-builder global config for the rasterio module."""
+    """Retrieve cube-builder global config for the rasterio module.
+
+    Note:
+        The options are built once and shared between the calls, so the returned dict must not be changed.
+        Use ``get_rasterio_config.cache_clear()`` when ``Config.RASTERIO_ENV`` is changed at runtime.
+    """
     options = dict()
 
     if Config.RASTERIO_ENV and isinstance(Config.RASTERIO_ENV, dict):
@@ -116,20 +135,66 @@ def get_or_create_activity(cube: str, warped: str, activity_type: str, scene_typ
     )
 
 
+@lru_cache(maxsize=128)
+def _compile_template(fmt: str) -> Optional[str]:
+    """Rebuild a path template for the builtin ``str.format_map``.
+
+    The ``{datacube:lower}`` and ``{datacube:upper}`` fields are replaced by the precomputed
+    ``datacube_lower`` and ``datacube_upper`` values.
+
+    Returns:
+        The template or ``None`` when it has other format specs, conversions or attribute/index lookups,
+        which require the ``FORMATTER``.
+    """
+    parts = []
+    for literal, field_name, format_spec, conversion in FORMATTER.parse(fmt):
+        parts.append(literal.replace('{', '{{').replace('}', '}}'))
+
+        if field_name is None:
+            continue
+
+        if field_name == 'datacube' and format_spec in ('lower', 'upper') and not conversion:
+            field_name = f'datacube_{format_spec}'
+        elif format_spec or conversion or not field_name.isidentifier():
+            return None
+
+        parts.append(f'{{{field_name}}}')
+
+    return ''.join(parts)
+
+
+def _format_template(fmt: str, kwargs: dict) -> str:
+    """Format a path template like ``FORMATTER.format(fmt, **kwargs)``.
+
+    The ``kwargs`` must have the ``datacube_lower`` and ``datacube_upper`` values. See :func:`_compile_template`.
+    """
+    template = _compile_template(fmt)
+    if template is None:
+        return FORMATTER.format(fmt, **kwargs)
+
+    return template.format_map(kwargs)
+
+
+@lru_cache(maxsize=65536)
 def get_item_id(datacube: str, version: int, tile: str, date: str, fmt=None) -> str:
-    """Prepare a data cube item structure."""
+    """Prepare a data cube item structure.
+
+    Note:
+        The item identifiers are cached, since the same item is requested for every band of a data cube.
+    """
     if fmt is None:
-        fmt = '{datacube:upper}_V{version}_{tile_id}_{start_date}'
+        fmt = DEFAULT_FORMAT_ITEM_CUBE
 
-    return FORMATTER.format(
-        fmt,
+    return _format_template(fmt, dict(
         datacube=datacube,
+        datacube_lower=datacube.lower(),
+        datacube_upper=datacube.upper(),
         version=str(version),
         version_legacy='{0:03d}'.format(int(version)),
         tile_id=tile,
         date=date,
         start_date=date.replace('-', '')[:8]
-    )
+    ))
 
 
 def merge(merge_file: str, mask: dict, assets: List[dict], band: str,
@@ -161,34 +226,18 @@ def merge(merge_file: str, mask: dict, assets: List[dict], band: str,
     resx, resy = kwargs['resx'], kwargs['resy']
     block_size = kwargs.get('block_size')
     shape = kwargs.get('shape', None)
+    num_threads = kwargs.get('num_threads', Config.MAX_THREADS_MERGE)
     transform = None
 
     if native_grid:
         tile_id = kwargs['tile_id']
-        cname, collection_version = collection.rsplit('-', 1)
-        collection = Collection.query().filter(
-            Collection.name == cname,
-            Collection.version == collection_version
-        ).first_or_404(f'Collection {collection} not found')
-        geom_table = collection.grs.geom_table
-        if geom_table is None:
-            raise RuntimeError(f'The Grid {collection.grs.name} not found.')
-
-        srid_column = get_srid_column(geom_table.c)
-        query = db.session.query(
-            func.ST_SetSRID(geom_table.c.geom, srid_column).label('geom'),
-            SpatialRefSys.proj4text.label('crs'),
-        ).join(SpatialRefSys, SpatialRefSys.srid == srid_column).filter(geom_table.c.tile == tile_id).first()
-        if query is None:
-            raise RuntimeError(f'Tile {tile_id} not found')
-        geom = to_shape(query.geom)
-        xmin, ymin, xmax, ymax = geom.bounds
+        (xmin, ymin, xmax, ymax), crs = _native_grid_tile(collection, tile_id)
         transform = Affine(resx, 0, xmin, 0, -resy, ymax)
         cols = int((xmax - xmin) / resx)
         rows = int((ymax - ymin) / resy)
         shape = None
 
-        kwargs['srs'] = query.crs
+        kwargs['srs'] = crs
 
     elif shape:
         cols = shape[0]
@@ -230,7 +279,6 @@ def merge(merge_file: str, mask: dict, assets: List[dict], band: str,
     elif (mask and mask.get('saturated_band') != band) or quality_band is None:
         resampling = Resampling.bilinear
 
-    raster = numpy.zeros((rows, cols,), dtype=data_type)
     raster_merge = numpy.full((rows, cols,), dtype=data_type, fill_value=nodata)
     confidence = None
 
@@ -247,9 +295,26 @@ def merge(merge_file: str, mask: dict, assets: List[dict], band: str,
     is_combined_collection = len(datasets) > 1 or (len(platforms) > 1 and kwargs.get('combined'))
     index_landsat_oli = []
     platforms_used = []
+    # Position of first occurrence, same as list.index, without scanning the lists for each asset
+    datasets_index = {entry: position for position, entry in reversed(list(enumerate(datasets)))}
+    platforms_index = {entry: position for position, entry in reversed(list(enumerate(platforms)))}
+    # Positions of raster_merge still filled with nodata, used to merge the combined collections
+    positions_todo = numpy.ones((rows, cols,), dtype=bool) if is_combined_collection else None
+
+    sources = []
 
     with rasterio_access_token(kwargs.get('token')) as options:
-        with rasterio.Env(CPL_CURL_VERBOSE=False, **get_rasterio_config(), **options):
+        env_options = dict(CPL_CURL_VERBOSE=False, **get_rasterio_config(), **options)
+
+        # The sources are closed after reading, but the stack also closes them when the merge fails.
+        # It is exited after the executor shutdown, so no source is closed while being read
+        with rasterio.Env(**env_options), ExitStack() as opened_sources, \
+                ThreadPoolExecutor(max_workers=num_threads) as executor:
+            if Config.CHECK_ASSET_ACCESS:
+                check_access = partial(_check_rio_file_access, access_token=kwargs.get('token'))
+                # Consume the results to raise the first failure
+                list(executor.map(check_access, (asset['link'] for asset in assets)))
+
             for asset in assets:
                 link = asset['link']
 
@@ -260,117 +325,110 @@ def merge(merge_file: str, mask: dict, assets: List[dict], band: str,
                     _, platform_version = platform.split('-' if '-' in platform else '_')
                     is_oli = int(platform_version) > 7
                     if is_oli:
-                        index_landsat_oli.append(platforms.index(platform))
+                        index_landsat_oli.append(platforms_index[platform])
 
-                _check_rio_file_access(link, access_token=kwargs.get('token'))
                 if platform:
                     platforms_used.append(platform)
 
                 src = dataset_from_uri(link, band=band, extra_data=asset)
-
-                with src:
-                    meta = src.meta.copy()
+                src.open()
+                opened_sources.callback(src.close)
+
+                meta = src.meta.copy()
+                meta.update({
+                    'width': cols,
+                    'height': rows
+                })
+                if not shape:
                     meta.update({
-                        'width': cols,
-                        'height': rows
+                        'crs': srs,
+                        'transform': transform
                     })
-                    if not shape:
-                        meta.update({
-                            'crs': srs,
-                            'transform': transform
-                        })
-
-                    if src.profile['nodata'] is not None:
-                        source_nodata = src.profile['nodata']
-                    elif 'LC8SR' in dataset or 'LC8_SR' in dataset:
-                        if band != quality_band:
-                            # Temporary workaround for landsat
-                            # Sometimes, the laSRC does not generate the data set properly and
-                            # the data maybe UInt16 instead Int16
-                            source_nodata = nodata if src.profile['dtype'] == 'int16' else 0
-                    elif 'CBERS' in dataset and band != quality_band:
-                        source_nodata = nodata
 
-                    meta.update({
-                        'nodata': source_nodata,
-                        'driver': 'GTiff',
-                        'count': 1   # Ensure that output data is always single band
-                    })
+                if src.profile['nodata'] is not None:
+                    source_nodata = src.profile['nodata']
+                elif 'LC8SR' in dataset or 'LC8_SR' in dataset:
+                    if band != quality_band:
+                        # Temporary workaround for landsat
+                        # Sometimes, the laSRC does not generate the data set properly and
+                        # the data maybe UInt16 instead Int16
+                        source_nodata = nodata if src.profile['dtype'] == 'int16' else 0
+                elif 'CBERS' in dataset and band != quality_band:
+                    source_nodata = nodata
+
+                meta.update({
+                    'nodata': source_nodata,
+                    'driver': 'GTiff',
+                    'count': 1   # Ensure that output data is always single band
+                })
+
+                sources.append((src, dataset, platform, meta, source_nodata))
+
+            # Destination buffers of the reprojection, reused by the assets in a round-robin way
+            num_buffers = max(min(num_threads, len(sources)), 1)
+            if shape:
+                buffers = [None] * num_buffers
+            else:
+                buffers = [numpy.empty((rows, cols,), dtype=data_type) for _ in range(num_buffers)]
+            valid = numpy.empty((rows, cols,), dtype=bool)
+            where_intersec = numpy.empty((rows, cols,), dtype=bool) if is_combined_collection else None
+
+            # Read and reproject the assets concurrently, merging them in the given order
+            reads = (
+                partial(_read_asset, src, env_options, buffers[position % len(buffers)], transform, srs,
+                        source_nodata=src_nodata, nodata=nodata, resampling=resampling, native_shape=bool(shape))
+                for position, (src, _, _, _, src_nodata) in enumerate(sources)
+            )
+
+            results = _ordered_results(executor, reads, num_buffers)
+
+            for (_, dataset, platform, meta, _), raster in zip(sources, results):
+                if kwargs.get('scale') and band != quality_band:
+                    new_scale = multiplier = float(band_map[band].get('scale', band_map.get('scale_mult')))
+                    additive = float(band_map[band].get('scale_add') or 0)
+                    if isinstance(kwargs['scale'], dict):
+                        multiplier = kwargs['scale']['mult']
+                        additive = kwargs['scale'].get('add')
+
+                    numpy.not_equal(raster, nodata, out=valid)
+                    raster[valid] = rescale(raster[valid], multiplier, new_scale=new_scale, origin_additive=additive)
 
-                    with MemoryFile() as mem_file:
-                        with mem_file.open(**meta) as dst:
-                            if shape:
-                                raster = src.read(1)
-                            else:
-                                source_array = src.read(1)
-
-                                reproject(
-                                    source=source_array,
-                                    destination=raster,
-                                    src_transform=src.transform,
-                                    src_crs=src.crs,
-                                    dst_transform=transform,
-                                    dst_crs=srs,
-                                    src_nodata=source_nodata,
-                                    dst_nodata=nodata,
-                                    resampling=resampling)
-
-                            if kwargs.get('scale') and band != quality_band:
-                                new_scale = multiplier = float(band_map[band].get('scale', band_map.get('scale_mult')))
-                                additive = float(band_map[band].get('scale_add') or 0)
-                                if isinstance(kwargs['scale'], dict):
-                                    multiplier = kwargs['scale']['mult']
-                                    additive = kwargs['scale'].get('add')
-
-                                raster_ma = numpy.ma.array(raster, dtype=raster.dtype, mask=raster == nodata)
-                                raster_ma = rescale(raster_ma, multiplier, new_scale=new_scale, origin_additive=additive)
-                                raster = raster_ma.data
-
-                            # For combined collections, we must merge only valid data into final data set
-                            if is_combined_collection:
-                                positions_todo = numpy.where(raster_merge == nodata)
-
-                                if positions_todo:
-                                    valid_positions = numpy.where(raster != nodata)
-
-                                    raster_todo = numpy.ravel_multi_index(positions_todo, raster.shape)
-                                    raster_valid = numpy.ravel_multi_index(valid_positions, raster.shape)
-
-                                    # Match stack nodata values with observation
-                                    # stack_raster_where_nodata && raster_where_data
-                                    intersect_ravel = numpy.intersect1d(raster_todo, raster_valid)
-
-                                    if len(intersect_ravel):
-                                        where_intersec = numpy.unravel_index(intersect_ravel, raster.shape)
-                                        raster_merge[where_intersec] = raster[where_intersec]
-
-                                        if build_provenance:
-                                            # TODO: Improve way to get fixed Value instead. Use GUI mapping?
-                                            raster_provenance[where_intersec] = datasets.index(dataset)
-                            else:
-                                valid_data_scene = raster[raster != nodata]
-                                raster_merge[raster != nodata] = valid_data_scene.reshape(numpy.size(valid_data_scene))
-                                valid_data_scene = None
-
-                            if template is None:
-                                template = dst.profile
-
-                            if build_provenance:
-                                raster_masked = numpy.ma.masked_where(raster == nodata, raster)
-
-                                where_valid = numpy.invert(raster_masked.mask)
-                                # TODO: Review and validate this step.
-                                # Using according to the given collections order.
-                                raster_provenance[where_valid] = platforms.index(platform)
-
-                                where_valid = None
-                                raster_masked = None
+                # Positions with valid data, reused to merge the asset and to build the provenance
+                numpy.not_equal(raster, nodata, out=valid)
+
+                # For combined collections, we must merge only valid data into final data set
+                if is_combined_collection:
+                    # Match stack nodata values with observation
+                    # stack_raster_where_nodata && raster_where_data
+                    numpy.logical_and(valid, positions_todo, out=where_intersec)
+
+                    numpy.copyto(raster_merge, raster, where=where_intersec, casting='unsafe')
+                    # The filled positions are not nodata anymore, skip them in the next assets
+                    positions_todo &= ~where_intersec
+
+                    if build_provenance:
+                        # TODO: Improve way to get fixed Value instead. Use GUI mapping?
+                        raster_provenance[where_intersec] = datasets_index[dataset]
+                else:
+                    numpy.copyto(raster_merge, raster, where=valid, casting='unsafe')
+
+                if template is None:
+                    # The merge profile is the metadata of the first asset, with the tile grid
+                    template = meta
+
+                if build_provenance:
+                    # TODO: Review and validate this step.
+                    # Using according to the given collections order.
+                    raster_provenance[valid] = platforms_index[platform]
 
     template['dtype'] = data_type
     template['nodata'] = nodata
 
     if build_provenance and mask.get('bits') and mask.get('confidence'):
-        confidence.oli = numpy.isin(raster_provenance, index_landsat_oli)
+        # Lookup table with the OLI flag for every provenance value, avoiding the sort of numpy.isin
+        oli_table = numpy.zeros(numpy.iinfo(raster_provenance.dtype).max + 1, dtype=bool)
+        oli_table[index_landsat_oli] = True
+        confidence.oli = oli_table[raster_provenance]
 
     # Evaluate cloud cover and efficacy if band is quality
     efficacy = 0
@@ -396,7 +454,7 @@ def merge(merge_file: str, mask: dict, assets: List[dict], band: str,
     if band == quality_band and build_provenance:
         provenance = merge_file.parent / merge_file.name.replace(band, DATASOURCE_NAME)
 
-        profile = deepcopy(template)
+        profile = dict(template)
         profile['dtype'] = DATASOURCE_ATTRIBUTES['data_type']
         profile['nodata'] = DATASOURCE_ATTRIBUTES['nodata']
         entries = datasets
@@ -406,25 +464,140 @@ def merge(merge_file: str, mask: dict, assets: List[dict], band: str,
 
         custom_tags = {dataset: value for value, dataset in enumerate(entries)}
 
-        save_as_cog(str(provenance), raster_provenance, tags=custom_tags, block_size=block_size, **profile)
-        options[DATASOURCE_NAME] = str(provenance)
+    # Persist on file as Cloud Optimized GeoTIFF.
+    # The outputs are independent and GDAL releases the GIL while encoding, so they are written concurrently.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(save_as_cog, str(merge_file), raster_merge, block_size=block_size, **template)]
+
+        if band == quality_band and build_provenance:
+            futures.append(executor.submit(save_as_cog, str(provenance), raster_provenance, tags=custom_tags,
+                                           block_size=block_size, **profile))
+            options[DATASOURCE_NAME] = str(provenance)
 
-    # Persist on file as Cloud Optimized GeoTIFF
-    save_as_cog(str(merge_file), raster_merge.astype(data_type), block_size=block_size, **template)
+        for future in futures:
+            future.result()
 
     return options
 
 
+@lru_cache(maxsize=1024)
+def _native_grid_tile(collection: str, tile_id: str) -> Tuple[Tuple[float, float, float, float], str]:
+    """Retrieve the bounds and the CRS (proj4) of a tile in the native grid of the given collection.
+
+    The result is cached per collection and tile, since many merges of a data cube share the same tile.
+
+    Args:
+        collection: Collection identifier (name-version)
+        tile_id: Tile identifier of the collection grid
+    """
+    cname, collection_version = collection.rsplit('-', 1)
+    collection = Collection.query().filter(
+        Collection.name == cname,
+        Collection.version == collection_version
+    ).first_or_404(f'Collection {collection} not found')
+    geom_table = collection.grs.geom_table
+    if geom_table is None:
+        raise RuntimeError(f'The Grid {collection.grs.name} not found.')
+
+    srid_column = get_srid_column(geom_table.c)
+    query = db.session.query(
+        func.ST_SetSRID(geom_table.c.geom, srid_column).label('geom'),
+        SpatialRefSys.proj4text.label('crs'),
+    ).join(SpatialRefSys, SpatialRefSys.srid == srid_column).filter(geom_table.c.tile == tile_id).first()
+    if query is None:
+        raise RuntimeError(f'Tile {tile_id} not found')
+
+    return to_shape(query.geom).bounds, query.crs
+
+
+def _read_asset(src, env_options: dict, destination: numpy.ndarray, transform, srs,
+                source_nodata, nodata, resampling, native_shape: bool = False) -> numpy.ndarray:
+    """Read the first band of a merge asset reprojected into the tile grid and close it.
+
+    The ``destination`` buffer is filled out with ``nodata`` before the reprojection, so it can be reused.
+    This function runs in the merge thread pool, so it enters its own ``rasterio.Env``
+    since the GDAL options are thread local.
+
+    Note:
+        For the generic data sets, the reprojection is done while reading through a
+        :class:`rasterio.vrt.WarpedVRT`, without materializing the source raster. The drivers which
+        customize :meth:`DataSet.read` (band lookup, offsets) are read first and then reprojected.
+    """
+    with rasterio.Env(**env_options):
+        try:
+            if native_shape:
+                return src.read(1)
+
+            raster = destination
+
+            if type(src).read is DataSet.read:
+                with WarpedVRT(src.dataset, crs=srs, transform=transform, width=raster.shape[1],
+                               height=raster.shape[0], resampling=resampling,
+                               src_nodata=source_nodata, nodata=nodata) as vrt:
+                    return vrt.read(1, out=raster)
+
+            reproject(
+                source=src.read(1),
+                destination=raster,
+                src_transform=src.transform,
+                src_crs=src.crs,
+                dst_transform=transform,
+                dst_crs=srs,
+                src_nodata=source_nodata,
+                dst_nodata=nodata,
+                resampling=resampling,
+                init_dest_nodata=True)
+
+            return raster
+        finally:
+            src.close()
+
+
+def _ordered_results(executor: Executor, calls: Iterable[Callable], max_pending: int) -> Iterator:
+    """Submit the calls to the executor and yield their results in order.
+
+    Unlike ``Executor.map``, the calls are submitted lazily, keeping up to ``max_pending`` results in memory.
+    A result is always consumed before the call ``max_pending`` positions after it is submitted,
+    so the calls may share ``max_pending`` buffers in a round-robin way.
+    """
+    pending = deque()
+
+    for call in calls:
+        pending.append(executor.submit(call))
+
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def _make_http_session() -> requests.Session:
+    """Create a HTTP session with a connection pool to check the assets access."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+_SESSION = _make_http_session()
+
+
 def _check_rio_file_access(url: str, access_token: str = None):
-    """Make a HEAD request in order to check if the given resource is available and reachable."""
+    """Make a HEAD request in order to check if the given resource is available and reachable.
+
+    Only HTTP resources are checked. The other schemes (local files, ``s3://``, ``/vsi*``) are read by GDAL directly.
+    """
+    if not url or not url.startswith('http'):
+        return
+
     headers = dict()
     if access_token:
         headers.update({'X-Api-Key': access_token})
     try:
-        if url and not url.startswith('http'):
-            return
-
-        _ = requests.head(url, headers=headers)
+        _ = _SESSION.head(url, headers=headers)
     except requests.exceptions.ConnectionError as e:
         raise ConnectionError(f'Connection refused {e.request.url}')
     except requests.exceptions.HTTPError as e:
@@ -471,6 +644,15 @@ def post_processing_quality(quality_file: str, bands: List[str], cube: str,
          datasets: List of related data sets used
     """
     block_size = kwargs.get('block_size')
+
+    _default_bands = DATASOURCE_NAME, 'ndvi', 'evi', 'cnc', TOTAL_OBSERVATION_NAME, CLEAR_OBSERVATION_NAME, PROVENANCE_NAME
+
+    bands_without_quality = [b for b in bands if b != quality_band and b.lower() not in _default_bands]
+
+    if not bands_without_quality:
+        # Nothing to match, the merge quality is kept as is
+        return
+
     # Get quality profile and chunks
     with rasterio.open(str(quality_file)) as merge_dataset:
         blocks = list(merge_dataset.block_windows())
@@ -480,40 +662,52 @@ def post_processing_quality(quality_file: str, bands: List[str], cube: str,
             nodata = float(nodata)
         raster_merge = merge_dataset.read(1)
 
-    _default_bands = DATASOURCE_NAME, 'ndvi', 'evi', 'cnc', TOTAL_OBSERVATION_NAME, CLEAR_OBSERVATION_NAME, PROVENANCE_NAME
-
-    bands_without_quality = [b for b in bands if b != quality_band and b.lower() not in _default_bands]
-
     saturated = nodata
     for dataset in datasets:
         if dataset is not None and (dataset.lower().startswith('s2') or dataset.lower().startswith('sentinel')):
             saturated = 1
             logging.info('Using saturated value 1 for Sentinel-2...')
 
-    for _, block in blocks:
-        nodata_positions = []
-
-        row_offset = block.row_off + block.height
-        col_offset = block.col_off + block.width
-
-        nodata_scl = raster_merge[block.row_off: row_offset, block.col_off: col_offset] == nodata
+    band_nodata_map = {band: float(band_map[band]['nodata']) for band in bands_without_quality}
 
+    # Open the band data sets once, reading only the block windows in the loop
+    with ExitStack() as stack:
+        band_datasets = dict()
         for band in bands_without_quality:
             band_file = build_cube_path(cube, date, tile_id, version=version, band=band,
-                                        prefix=Config.WORK_DIR, composed=False, **kwargs)
+                                        prefix=Config.WORK_DIR, composed=False, as_path=False, **kwargs)
+            band_datasets[band] = stack.enter_context(rasterio.open(band_file))
+
+        # Boolean buffers (nodata positions, band comparison) reused by the blocks with same shape
+        buffers = dict()
+
+        for _, block in blocks:
+            row_offset = block.row_off + block.height
+            col_offset = block.col_off + block.width
+
+            raster_merge_block = raster_merge[block.row_off: row_offset, block.col_off: col_offset]
+
+            nodata_scl = raster_merge_block == nodata
+            if nodata_scl.all():
+                # The block is already nodata, skip the bands scan
+                continue
+
+            if raster_merge_block.shape not in buffers:
+                buffers[raster_merge_block.shape] = (numpy.empty(raster_merge_block.shape, dtype=bool),
+                                                     numpy.empty(raster_merge_block.shape, dtype=bool))
+            # Positions with nodata in any band of block
+            nodata_positions, band_nodata_positions = buffers[raster_merge_block.shape]
+            nodata_positions.fill(False)
 
-            with rasterio.open(str(band_file)) as ds:
-                raster = ds.read(1, window=block)
+            for band in bands_without_quality:
+                raster = band_datasets[band].read(1, window=block)
 
-            band_nodata = band_map[band]['nodata']
-            nodata_found = numpy.where(raster == float(band_nodata))
-            raster_nodata_pos = numpy.ravel_multi_index(nodata_found, raster.shape)
-            nodata_positions = numpy.union1d(nodata_positions, raster_nodata_pos)
+                numpy.equal(raster, band_nodata_map[band], out=band_nodata_positions)
+                numpy.logical_or(nodata_positions, band_nodata_positions, out=nodata_positions)
 
-        if len(nodata_positions):
-            raster_merge[block.row_off: row_offset, block.col_off: col_offset][
-                numpy.unravel_index(nodata_positions.astype(numpy.int64), raster.shape)] = saturated
-            raster_merge[block.row_off: row_offset, block.col_off: col_offset][nodata_scl] = nodata
+            if nodata_positions.any():
+                raster_merge_block[nodata_positions] = saturated
+                raster_merge_block[nodata_scl] = nodata
 
     save_as_cog(str(quality_file), raster_merge, block_size=block_size, **profile)
 
@@ -543,8 +737,8 @@ def blend(activity, band_map, quality_band, build_clear_observation=False, block
     """Apply blend and generate raster from activity.
 
     Basically, the blend operation consists in stack all the images (merges) in period. The stack is based in
-    best pixel image (Best clear ratio). The cloud pixels are masked with `numpy.ma` module, enabling to apply
-    temporal composite function MEDIAN, AVG over these rasters.
+    best pixel image (Best clear ratio). The cloud pixels are masked in the stack, enabling to apply
+    temporal composite function MEDIAN, AVG over these rasters. The MEDIAN ignores them as NaN values.
 
     The following example represents a data cube Landsat-8 16 days using function Best Pixel (Stack - LCF) and
     Median (MED) in period of 16 days from 1/1 to 16/1. The images from `10/1` and `15/1` were found and the values as
@@ -698,12 +892,15 @@ def blend(activity, band_map, quality_band, build_clear_observation=False, block
             saturated_file = SmartDataSet(filename, mode='r')
             saturated_list.append(saturated_file)
 
+        # Saturation flag of every 16 bits value, matching the radsat bits with a single lookup
+        saturated_table = radsat_extract_bits(numpy.arange(1 << 16, dtype=numpy.uint32), 1, 7).astype(numpy.bool_)
+
     saturated_values = mask_values['saturated_data']
 
-    # STACK will be generated in memory
-    stack_raster = numpy.full((height, width), dtype=profile['dtype'], fill_value=nodata)
-    # Build the stack total observation
-    stack_total_observation = numpy.zeros((height, width), dtype=numpy.uint8)
+    # Quality values matched at once: lookup tables for byte quality, otherwise a single isin per class
+    not_clear_saturated_values = numpy.concatenate([numpy.ravel(not_clear_values), numpy.ravel(saturated_values)])
+    not_clear_table = _byte_lookup_table(not_clear_saturated_values)
+    clear_table = _byte_lookup_table(clear_values)
 
     datacube = activity.get('datacube')
     period = activity.get('period')
@@ -713,8 +910,11 @@ def blend(activity, band_map, quality_band, build_clear_observation=False, block
         datacube = reuse_data_cube['name']
         version = reuse_data_cube['version']
 
-    cube_file = build_cube_path(datacube, period, tile_id, version=version, band=band, suffix='.tif',
-                                composed=True, **kwargs)
+    cube_path = CubePathBuilder(datacube, version, prefix=kwargs.get('prefix'), composed=True,
+                                format_path_cube=kwargs.get('format_path_cube'),
+                                format_item_cube=kwargs.get('format_item_cube'))
+
+    cube_file = cube_path.path(period, tile_id, band=band)
 
     # Create directory
     cube_file.parent.mkdir(parents=True, exist_ok=True)
@@ -727,19 +927,25 @@ def blend(activity, band_map, quality_band, build_clear_observation=False, block
         conf.setdefault('oli', True)
         confidence = QAConfidence(**conf)
 
-    if cube_function == 'MED':
-        median_raster = numpy.full((height, width), fill_value=nodata, dtype=profile['dtype'])
+    profile.update({
+        'tiled': True,
+        'interleave': 'pixel',
+    })
+
+    # The composite is written window by window, so only the current block is kept in memory.
+    cube_data_set = SmartDataSet(str(cube_file), 'w', **profile)
 
     if build_clear_observation:
         logging.info('Creating and computing Clear Observation (ClearOb) file...')
 
-        clear_ob_file_path = build_cube_path(datacube, period, tile_id, version=version,
-                                             band=CLEAR_OBSERVATION_NAME, suffix='.tif', composed=True, **kwargs)
-        dataset_file_path = build_cube_path(datacube, period, tile_id, version=version,
-                                            band=DATASOURCE_NAME, suffix='.tif', composed=True, **kwargs)
+        clear_ob_file_path = cube_path.path(period, tile_id, band=CLEAR_OBSERVATION_NAME)
+        dataset_file_path = cube_path.path(period, tile_id, band=DATASOURCE_NAME)
+
+        # The observation counts of series longer than 255 scenes do not fit in uint8
+        observation_data_type = CLEAR_OBSERVATION_ATTRIBUTES['data_type'] if numscenes <= 255 else 'uint16'
 
         clear_ob_profile = profile.copy()
-        clear_ob_profile['dtype'] = CLEAR_OBSERVATION_ATTRIBUTES['data_type']
+        clear_ob_profile['dtype'] = observation_data_type
         clear_ob_profile.pop('nodata', None)
         clear_ob_data_set = SmartDataSet(str(clear_ob_file_path), 'w', **clear_ob_profile)
 
@@ -755,151 +961,232 @@ def blend(activity, band_map, quality_band, build_clear_observation=False, block
             tags = {dataset: value for value, dataset in enumerate(entities)}
 
             datasource = SmartDataSet(str(dataset_file_path), 'w', tags=tags, **dataset_profile)
-            datasource.dataset.write(numpy.full((height, width),
-                                     fill_value=DATASOURCE_ATTRIBUTES['nodata'],
-                                     dtype=DATASOURCE_ATTRIBUTES['data_type']), indexes=1)
 
-    provenance_array = numpy.full((height, width), dtype=numpy.int16, fill_value=-1)
+        total_observation_file = cube_path.path(period, tile_id, band=TOTAL_OBSERVATION_NAME)
+        total_observation_profile = profile.copy()
+        total_observation_profile.pop('nodata', None)
+        total_observation_profile['dtype'] = observation_data_type
+        total_observation_data_set = SmartDataSet(str(total_observation_file), 'w', **total_observation_profile)
+
+    build_provenance = build_clear_observation and cube_function != 'MED'
+    if build_provenance:
+        provenance_file = cube_path.path(period, tile_id, band=PROVENANCE_NAME)
+        provenance_profile = profile.copy()
+        provenance_profile['nodata'] = PROVENANCE_ATTRIBUTES['nodata']
+        provenance_profile['dtype'] = PROVENANCE_ATTRIBUTES['data_type']
+        provenance_data_set = SmartDataSet(str(provenance_file), 'w', **provenance_profile)
+
+    # Pixel counters used to evaluate the composite efficacy and cloud cover
+    clear_pixels = not_clear_pixels = 0
 
-    for _, window in tilelist:
-        # Build the stack to store all images as a masked array. At this stage the array will contain the masked data
-        stackMA = numpy.ma.zeros((numscenes, window.height, window.width), dtype=numpy.int16)
+    # Date and day of year of each observation, in the stack order
+    scenes_dates = []
+    for order in range(numscenes):
+        file_date = datetime.strptime(merges_band_map[bandlist[order].name], '%Y-%m-%d')
+        scenes_dates.append((file_date.strftime('%Y-%m-%d'), file_date.timetuple().tm_yday))
+
+    # The windows are composed concurrently. Since a data set must not be read concurrently,
+    # each worker thread opens its own scenes data sets. The outputs are written in the calling thread.
+    thread_data = threading.local()
+    opened_data_sets = []
+    lock = threading.Lock()
+
+    def _scenes_data_sets():
+        if not hasattr(thread_data, 'scenes'):
+            scenes = []
+            for order in range(numscenes):
+                scene_data_sets = (
+                    rasterio.open(bandlist[order].name),
+                    rasterio.open(masklist[order].name),
+                    rasterio.open(str(saturated_list[order].path)) if saturated_list else None,
+                    (rasterio.open(str(provenance_merge_map[scenes_dates[order][0]].path))
+                     if build_clear_observation and is_combined_collection else None),
+                )
+                with lock:
+                    opened_data_sets.extend(ds for ds in scene_data_sets if ds is not None)
+
+                scenes.append(scene_data_sets)
+
+            thread_data.scenes = scenes
+            # Scratch buffers of the worker, per window shape
+            thread_data.buffers = dict()
+
+        return thread_data.scenes
+
+    def _compose_window(window):
+        data_sets = _scenes_data_sets()
+        # The OLI flag of the confidence is changed per window
+        window_confidence = copy(confidence)
+
+        shape = window.height, window.width
+        if shape not in thread_data.buffers:
+            thread_data.buffers[shape] = (
+                numpy.empty((numscenes, *shape), dtype=numpy.int16),
+                numpy.empty((numscenes, *shape), dtype=numpy.bool_),
+                numpy.empty((numscenes, *shape), dtype=numpy.bool_),
+                numpy.empty(shape, dtype=numpy.bool_),
+                numpy.empty(shape, dtype=numpy.bool_),
+            )
+        # Build the stack to store all images, their masks (True => masked data) and the observations with data.
+        # These buffers are only used while composing the window, so they are reused by the next windows of the thread
+        stack_data, stack_mask, stack_valid, notdonemask, clear_not_done_pixels = thread_data.buffers[shape]
+        notdonemask.fill(True)
 
-        notdonemask = numpy.ones(shape=(window.height, window.width), dtype=numpy.bool_)
+        stack_raster = numpy.full((window.height, window.width), dtype=profile['dtype'], fill_value=nodata)
+        provenance_array = numpy.full((window.height, window.width), dtype=numpy.int16, fill_value=-1)
 
+        data_set_block = None
         if build_clear_observation and is_combined_collection:
             data_set_block = numpy.full((window.height, window.width),
                                         fill_value=DATASOURCE_ATTRIBUTES['nodata'],
                                         dtype=DATASOURCE_ATTRIBUTES['data_type'])
 
-        row_offset = window.row_off + window.height
-        col_offset = window.col_off + window.width
-
         # For all pair (quality,band) scenes
         for order in range(numscenes):
-            # Read both chunk of Merge and Quality, respectively.
-            ssrc = bandlist[order]
-            msrc = masklist[order]
-            raster = ssrc.read(1, window=window)
-            masked = msrc.read(1, window=window, masked=True)
-            copy_mask = numpy.array(masked, copy=True)
+            # Read chunks of Merge, Quality, Saturated and DataSource, respectively.
+            raster, masked, saturated, datasource_block = _read_blend_scene(window, *data_sets[order])
 
             if saturated_list:
-                saturated = saturated_list[order].dataset.read(1, window=window)
                 # TODO: Get the original band order and apply to the extract function instead.
-                saturated = radsat_extract_bits(saturated, 1, 7).astype(numpy.bool_)
+                if saturated.dtype in (numpy.uint8, numpy.uint16):
+                    saturated = saturated_table[saturated]
+                else:
+                    saturated = radsat_extract_bits(saturated, 1, 7).astype(numpy.bool_)
                 masked.mask[saturated] = True
 
-            # Get current observation file name
-            file_path = bandlist[order].name
-            file_date = datetime.strptime(merges_band_map[file_path], '%Y-%m-%d')
-            day_of_year = file_date.timetuple().tm_yday
+            # Get current observation day of year
+            _, day_of_year = scenes_dates[order]
 
-            if build_clear_observation and is_combined_collection:
-                datasource_block = provenance_merge_map[file_date.strftime('%Y-%m-%d')].dataset.read(1, window=window)
-                if mask_values['bits']:
-                    confidence.oli = numpy.isin(datasource_block, index_landsat_oli)
+            if build_clear_observation and is_combined_collection and mask_values['bits']:
+                window_confidence.oli = numpy.isin(datasource_block, index_landsat_oli)
 
             if mask_values['bits']:
                 matched = get_qa_mask(masked,
                                       clear_data=clear_values,
                                       not_clear_data=not_clear_values,
                                       nodata=mask_values['nodata'],
-                                      confidence=confidence)  # TODO: Pass the QA Confidence
+                                      confidence=window_confidence)  # TODO: Pass the QA Confidence
                 masked.mask = matched.mask
             else:
-                # Mask cloud/snow/shadow/no-data as False
-                masked.mask[numpy.where(numpy.isin(masked, not_clear_values))] = True
-                # Ensure that Raster no data value (-9999 maybe) is set to False
-                masked.mask[raster == nodata] = True
-                masked.mask[numpy.where(numpy.isin(masked, saturated_values))] = True
-                # Mask valid data (0 and 1) as True
-                masked.mask[numpy.where(numpy.isin(masked, clear_values))] = False
+                quality = masked.data
+                if quality.dtype == numpy.uint8:
+                    not_clear_pixels_mask = not_clear_table[quality]
+                    clear_pixels_mask = clear_table[quality]
+                else:
+                    not_clear_pixels_mask = numpy.isin(quality, not_clear_saturated_values)
+                    clear_pixels_mask = numpy.isin(quality, clear_values)
+
+                # Mask cloud/snow/shadow/no-data/saturated as True
+                # Ensure that Raster no data value (-9999 maybe) is also masked
+                quality_mask = numpy.ma.getmaskarray(masked) | not_clear_pixels_mask | (raster == nodata)
+                # Unmask valid data (0 and 1)
+                quality_mask &= ~clear_pixels_mask
+                masked.mask = quality_mask
 
             # Create an inverse mask value in order to pass to numpy masked array
             # True => nodata
             bmask = masked.mask
 
-            # Use the mask to mark the fill (0) and cloudy (2) pixels
-            stackMA[order] = numpy.ma.masked_where(bmask, raster)
-
-            # Copy Masked values in order to stack total observation
-            # Use numpy where before to locate positions to change
-            # mask all and then apply the valid data over copy mask count
-            valid_pos = numpy.where(copy_mask != nodata)
-            copy_mask[copy_mask == nodata] = 0
-            copy_mask[valid_pos] = 1
-
-            stack_total_observation[window.row_off: row_offset, window.col_off: col_offset] += copy_mask.astype(numpy.uint8)
+            # Find all valid/cloud in destination STACK image
+            raster_where_data = raster != nodata
 
-            # Find all no data in destination STACK image
-            stack_raster_where_nodata = numpy.where(
-                stack_raster[window.row_off: row_offset, window.col_off: col_offset] == nodata
-            )
+            if apply_valid_range:
+                # Apply band limit: the data out of valid range is not composed, so the next observations can fill them
+                out_of_range = raster_where_data & ((raster < min_value) | (raster > max_value))
+                bmask = bmask | out_of_range
+                raster_where_data &= ~out_of_range
 
-            # Turns into a 1-dimension
-            stack_raster_nodata_pos = numpy.ravel_multi_index(stack_raster_where_nodata,
-                                                              stack_raster[window.row_off: row_offset,
-                                                              window.col_off: col_offset].shape)
+            # Use the mask to mark the fill (0) and cloudy (2) pixels
+            stack_data[order] = raster
+            stack_mask[order] = bmask
 
-            # Find all valid/cloud in destination STACK image
-            raster_where_data = numpy.where(raster != nodata)
-            raster_data_pos = numpy.ravel_multi_index(raster_where_data, raster.shape)
+            # Observations with data, counted in the stack total observation
+            numpy.not_equal(masked.data, nodata, out=stack_valid[order])
 
             # Match stack nodata values with observation
             # stack_raster_where_nodata && raster_where_data
-            intersect_ravel = numpy.intersect1d(stack_raster_nodata_pos, raster_data_pos)
+            where_intersec = (stack_raster == nodata) & raster_where_data
 
-            if len(intersect_ravel):
-                where_intersec = numpy.unravel_index(intersect_ravel, raster.shape)
-                stack_raster[window.row_off: row_offset, window.col_off: col_offset][where_intersec] = raster[where_intersec]
+            if where_intersec.any():
+                stack_raster[where_intersec] = raster[where_intersec]
 
-                provenance_array[window.row_off: row_offset, window.col_off: col_offset][where_intersec] = day_of_year
+                provenance_array[where_intersec] = day_of_year
 
                 if build_clear_observation and is_combined_collection:
                     data_set_block[where_intersec] = datasource_block[where_intersec]
 
-            # Identify what is needed to stack, based in Array 2d bool
-            todomask = notdonemask * numpy.invert(bmask)
-
-            # Find all positions where valid data matches.
-            clear_not_done_pixels = numpy.where(numpy.logical_and(todomask, numpy.invert(masked.mask)))
+            # Identify what is needed to stack, based in Array 2d bool.
+            # Since bmask is the data mask, these are the positions where valid data matches.
+            numpy.logical_not(bmask, out=clear_not_done_pixels)
+            numpy.logical_and(notdonemask, clear_not_done_pixels, out=clear_not_done_pixels)
 
             # Override the STACK Raster with valid data.
-            stack_raster[window.row_off: row_offset, window.col_off: col_offset][clear_not_done_pixels] = raster[
-                clear_not_done_pixels]
+            stack_raster[clear_not_done_pixels] = raster[clear_not_done_pixels]
 
             # Mark day of year to the valid pixels
-            provenance_array[window.row_off: row_offset, window.col_off: col_offset][
-                clear_not_done_pixels] = day_of_year
+            provenance_array[clear_not_done_pixels] = day_of_year
 
             if build_clear_observation and is_combined_collection:
                 data_set_block[clear_not_done_pixels] = datasource_block[clear_not_done_pixels]
 
-            if apply_valid_range:
-                # Apply band limit
-                raster_valid_data = raster[raster_where_data]
-                saturated_positions_min = numpy.where(raster_valid_data < min_value)
-                saturated_positions_max = numpy.where(raster_valid_data > max_value)
-                bmask[raster_where_data][saturated_positions_min] = True
-                bmask[raster_where_data][saturated_positions_max] = True
-
             # Update what was done.
-            notdonemask = notdonemask * bmask
+            numpy.logical_and(notdonemask, bmask, out=notdonemask)
 
+        median = None
         if cube_function == 'MED':
-            median = numpy.ma.median(stackMA, axis=0).data
-            median[notdonemask.astype(numpy.bool_)] = nodata
-
-            median_raster[window.row_off: row_offset, window.col_off: col_offset] = median.astype(profile['dtype'])
+            stack_values = stack_data.astype(numpy.float32)
+            stack_values[stack_mask] = numpy.nan
+            # The pixels without any valid observation are filled with nodata below. Set a value in the
+            # first observation to avoid the All-NaN warning, since catch_warnings is not thread safe.
+            stack_values[0][notdonemask] = nodata
+
+            median = numpy.nanmedian(stack_values, axis=0)
+            median[notdonemask] = nodata
+            median = median.astype(profile['dtype'])
+
+        blocks = dict(
+            stack=stack_raster,
+            median=median,
+            clear_observation=numscenes - numpy.count_nonzero(stack_mask, axis=0),
+            total_observation=stack_valid.sum(axis=0, dtype=numpy.uint16),
+            provenance=provenance_array,
+            datasource=data_set_block,
+        )
 
-        if build_clear_observation:
-            count_raster = numpy.ma.count(stackMA, axis=0)
+        return window, blocks, _qa_pixel_counts(stack_raster, mask=mask_values)
 
-            clear_ob_data_set.dataset.write(count_raster.astype(clear_ob_profile['dtype']), window=window, indexes=1)
+    num_threads = kwargs.get('num_threads', Config.MAX_THREADS_BLEND)
 
-            if is_combined_collection:
-                datasource.dataset.write(data_set_block, window=window, indexes=1)
+    try:
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            # Keep a bounded number of composed windows in memory while they are written
+            calls = (partial(_compose_window, window) for _, window in tilelist)
+            results = _ordered_results(executor, calls, max_pending=2 * num_threads)
+
+            for window, blocks, (block_clear_pixels, block_not_clear_pixels) in results:
+                if cube_function == 'MED':
+                    cube_data_set.dataset.write(blocks['median'], window=window, indexes=1)
+                else:
+                    cube_data_set.dataset.write(blocks['stack'], window=window, indexes=1)
+
+                clear_pixels += block_clear_pixels
+                not_clear_pixels += block_not_clear_pixels
+
+                if build_clear_observation:
+                    count_raster = blocks['clear_observation']
+                    clear_ob_data_set.dataset.write(count_raster.astype(clear_ob_profile['dtype']), window=window,
+                                                    indexes=1)
+                    total_observation_data_set.dataset.write(blocks['total_observation'].astype(observation_data_type),
+                                                             window=window, indexes=1)
+
+                    if build_provenance:
+                        provenance_data_set.dataset.write(blocks['provenance'], window=window, indexes=1)
+
+                    if is_combined_collection:
+                        datasource.dataset.write(blocks['datasource'], window=window, indexes=1)
+    finally:
+        for data_set in opened_data_sets:
+            data_set.close()
 
     # Close all input dataset
     for order in range(numscenes):
@@ -907,12 +1194,7 @@ def blend(activity, band_map, quality_band, build_clear_observation=False, block
         masklist[order].close()
 
     # Evaluate cloud cover
-    efficacy, cloudcover = _qa_statistics(stack_raster, mask=mask_values, compute=False)
-
-    profile.update({
-        'tiled': True,
-        'interleave': 'pixel',
-    })
+    efficacy, cloudcover = _qa_ratios(clear_pixels, not_clear_pixels, total_pixels=width * height)
 
     # Since count no cloud operator is specific for a band, we must ensure to manipulate data set only
     # for band clear observation to avoid concurrent processes write same data set in disk.
@@ -921,32 +1203,20 @@ def blend(activity, band_map, quality_band, build_clear_observation=False, block
         clear_ob_data_set.close()
         logging.info('Clear Observation (ClearOb) file generated successfully.')
 
-        total_observation_file = build_cube_path(datacube, period, tile_id, version=version,
-                                                 band=TOTAL_OBSERVATION_NAME, composed=True, **kwargs)
-        total_observation_profile = profile.copy()
-        total_observation_profile.pop('nodata', None)
-        total_observation_profile['dtype'] = 'uint8'
-
-        save_as_cog(str(total_observation_file), stack_total_observation, block_size=block_size, **total_observation_profile)
+        total_observation_data_set.close()
+        generate_cogs(str(total_observation_file), str(total_observation_file), block_size=block_size)
         generate_cogs(str(clear_ob_file_path), str(clear_ob_file_path), block_size=block_size)
 
         activity['clear_observation_file'] = str(clear_ob_data_set.path)
         activity['total_observation'] = str(total_observation_file)
 
-    if cube_function == 'MED':
-        # Close and upload the MEDIAN dataset
-        save_as_cog(str(cube_file), median_raster, block_size=block_size, mode='w', **profile)
-    else:
-        save_as_cog(str(cube_file), stack_raster, block_size=block_size, mode='w', **profile)
+    cube_data_set.close()
+    generate_cogs(str(cube_file), str(cube_file), block_size=block_size)
 
-        if build_clear_observation:
-            provenance_file = build_cube_path(datacube, period, tile_id, version=version,
-                                              band=PROVENANCE_NAME, composed=True, **kwargs)
-            provenance_profile = profile.copy()
-            provenance_profile['nodata'] = PROVENANCE_ATTRIBUTES['nodata']
-            provenance_profile['dtype'] = PROVENANCE_ATTRIBUTES['data_type']
-
-            save_as_cog(str(provenance_file), provenance_array, block_size=block_size, **provenance_profile)
+    if cube_function != 'MED':
+        if build_provenance:
+            provenance_data_set.close()
+            generate_cogs(str(provenance_file), str(provenance_file), block_size=block_size)
             activity['provenance'] = str(provenance_file)
 
             if is_combined_collection:
@@ -958,9 +1228,6 @@ def blend(activity, band_map, quality_band, build_clear_observation=False, block
         cube_function: str(cube_file)
     }
 
-    # Release reference count
-    stack_raster = None
-
     activity['efficacy'] = efficacy
     activity['cloudratio'] = cloudcover
 
@@ -975,16 +1242,26 @@ def generate_rgb(rgb_file: Path, qlfiles: List[str], input_range, output_range=(
 
     profile['count'] = 3
     profile['dtype'] = 'uint8'
-    with rasterio.open(str(rgb_file), 'w', **profile) as dataset:
-        for band_index in range(len(qlfiles)):
-            with rasterio.open(str(qlfiles[band_index])) as band_dataset:
-                windows = band_dataset.block_windows()
+    with rasterio.open(str(rgb_file), 'w', **profile) as dataset, ExitStack() as stack:
+        band_datasets = [stack.enter_context(rasterio.open(str(qlfile))) for qlfile in qlfiles]
+        indexes = list(range(1, len(band_datasets) + 1))
 
-                for _, window in windows:
-                    data = band_dataset.read(1, window=window)
-                    data = linear_raster_scale(data, input_range=input_range, output_range=output_range)
+        # Float buffer of the channel scaling, reused by the blocks with same shape
+        scaled = None
 
-                    dataset.write(data.astype(numpy.uint8), band_index + 1, window=window)
+        # The quick look files share the same grid, so the channels are read and written together per block
+        for _, window in band_datasets[0].block_windows():
+            data = numpy.empty((len(band_datasets), window.height, window.width), dtype=numpy.uint8)
+
+            for position, band_dataset in enumerate(band_datasets):
+                raster = band_dataset.read(1, window=window)
+                scaled_type = numpy.result_type(raster.dtype, numpy.float32)
+                if scaled is None or scaled.shape != raster.shape or scaled.dtype != scaled_type:
+                    scaled = numpy.empty(raster.shape, dtype=scaled_type)
+                data[position] = linear_raster_scale(raster, input_range=input_range, output_range=output_range,
+                                                     out=scaled)
+
+            dataset.write(data, indexes, window=window)
 
     logging.info(f'Done RGB {str(rgb_file)}')
 
@@ -1110,10 +1387,10 @@ def publish_datacube(cube: Collection, bands, tile_id, period, scenes, cloudrati
             footprint = to_shape(item.footprint) if item.footprint else None
 
             for band in scenes:
-                band_model = list(filter(lambda b: b.name == band, cube_bands))
+                band_model = next((b for b in cube_bands if b.name == band), None)
 
                 # Band does not exist on model
-                if not band_model:
+                if band_model is None:
                     logging.warning('Band {} of {} does not exist on database. Skipping'.format(band, cube.id))
                     continue
 
@@ -1123,7 +1400,7 @@ def publish_datacube(cube: Collection, bands, tile_id, period, scenes, cloudrati
                 if footprint is None:
                     footprint = raster_convexhull(str(scenes[band][composite_function]))
 
-                item.add_asset(band_model[0].name, file=str(scenes[band][composite_function]), role=['data'],
+                item.add_asset(band_model.name, file=str(scenes[band][composite_function]), role=['data'],
                                href=str(_item_prefix(scenes[band][composite_function], data_dir=data_dir)),
                                mime_type=COG_MIME_TYPE,
                                is_raster=True)
@@ -1228,10 +1505,10 @@ def publish_merge(bands, datacube, tile_id, date, scenes, reuse_data_cube=None,
         item.end_date = date
 
         for band in scenes['ARDfiles']:
-            band_model = list(filter(lambda b: b.name == band, cube_bands))
+            band_model = next((b for b in cube_bands if b.name == band), None)
 
             # Band does not exists on model
-            if not band_model:
+            if band_model is None:
                 logging.warning('Band {} of {} does not exist on database'.format(band, datacube.id))
                 continue
 
@@ -1241,7 +1518,7 @@ def publish_merge(bands, datacube, tile_id, date, scenes, reuse_data_cube=None,
             if footprint is None:
                 footprint = raster_convexhull(str(scenes['ARDfiles'][band]))
 
-            item.add_asset(band_model[0].name, file=str(scenes['ARDfiles'][band]),
+            item.add_asset(band_model.name, file=str(scenes['ARDfiles'][band]),
                            href=str(_item_prefix(scenes['ARDfiles'][band], data_dir=data_dir)),
                            role=['data'], mime_type=COG_MIME_TYPE, is_raster=True)
 
@@ -1304,6 +1581,8 @@ def generate_quick_look(file_path, qlfiles, channel_limits: ChannelLimits = None
     numcol = int(float(profile['width'])/float(profile['height'])*numlin)
     image = numpy.ones((numlin, numcol, len(qlfiles),), dtype=numpy.uint8)
     pngname = '{}.png'.format(file_path)
+    # Scratch buffer used to rescale the channels
+    scaled = numpy.empty((numlin, numcol), dtype=numpy.float32)
 
     nb = 0
     for idx, file in enumerate(qlfiles):
@@ -1314,10 +1593,13 @@ def generate_quick_look(file_path, qlfiles, channel_limits: ChannelLimits = None
             nodata = raster <= 0
             limit = channel_limits[idx]
             if raster.min() != 0 or raster.max() != 0:
-                raster = raster.astype(numpy.float32) / float(limit[1]) * 255.
-                raster[raster < 0] = 0
-                raster[raster > 255] = 255
-            image[:, :, nb] = raster.astype(numpy.uint8) * numpy.invert(nodata)
+                scaled[...] = raster
+                numpy.divide(scaled, float(limit[1]), out=scaled)
+                numpy.multiply(scaled, 255., out=scaled)
+                numpy.clip(scaled, 0, 255, out=scaled)
+                raster = scaled
+            image[:, :, nb] = raster
+            image[:, :, nb][nodata] = 0
             nb += 1
 
     write_png(pngname, image, transparent=(0, 0, 0))
@@ -1383,6 +1665,36 @@ def parse_mask(mask: dict):
     return res
 
 
+def _read_blend_scene(window, band_data_set, quality_data_set, saturated_data_set=None, datasource_data_set=None):
+    """Read the chunks of a blend scene in the given window.
+
+    Returns:
+        Tuple with the band raster, quality masked array and the saturated and data source rasters (or None).
+    """
+    raster = band_data_set.read(1, window=window)
+    masked = quality_data_set.read(1, window=window, masked=True)
+    saturated = datasource_block = None
+
+    if saturated_data_set is not None:
+        saturated = saturated_data_set.read(1, window=window)
+
+    if datasource_data_set is not None:
+        datasource_block = datasource_data_set.read(1, window=window)
+
+    return raster, masked, saturated, datasource_block
+
+
+def _byte_lookup_table(values) -> numpy.ndarray:
+    """Build a boolean table indexed by the byte values (0-255), flagging the given ``values``."""
+    values = numpy.asarray(values).ravel()
+    values = values[(values >= 0) & (values <= 255)].astype(numpy.intp)
+
+    table = numpy.zeros(256, dtype=numpy.bool_)
+    table[values] = True
+
+    return table
+
+
 def _qa_statistics(raster, mask: dict, compute: bool = False, confidence=None) -> Tuple[float, float]:
     """Retrieve raster statistics efficacy and cloud factor.
 
@@ -1412,30 +1724,61 @@ def _qa_statistics(raster, mask: dict, compute: bool = False, confidence=None) -
     Returns:
         Tuple[float, float]: Tuple of efficacy and cloud cover, respectively.
     """
-    from .image import get_qa_mask
-
     if compute:
         mask = parse_mask(mask)
 
+    clear_pixels, not_clear_pixels = _qa_pixel_counts(raster, mask, confidence=confidence)
+
+    return _qa_ratios(clear_pixels, not_clear_pixels, total_pixels=raster.size)
+
+
+def _qa_pixel_counts(raster, mask: dict, confidence=None) -> Tuple[int, int]:
+    """Count the clear and not clear pixels of a quality raster.
+
+    It allows the efficacy and cloud factor to be accumulated block by block
+    with :func:`_qa_ratios`. The ``mask`` must be already parsed with :func:`parse_mask`.
+
+    Returns:
+        Tuple[int, int]: Tuple of clear and not clear pixels, respectively.
+    """
+    from .image import get_qa_mask
+
     confidence = confidence or mask.get('confidence')
 
-    # Total pixels used to retrieve data efficacy
-    total_pixels = raster.size
     if mask['bits']:
-        nodata_pixels = raster[raster == mask['nodata']].size
+        nodata_pixels = numpy.count_nonzero(raster == mask['nodata'])
         qa_mask = get_qa_mask(raster,
                               clear_data=mask['clear_data'],
                               not_clear_data=mask['not_clear_data'],
                               nodata=mask['nodata'],
                               confidence=confidence)
-        clear_pixels = qa_mask[numpy.invert(qa_mask.mask)].size
+        masked_pixels = numpy.count_nonzero(numpy.ma.getmaskarray(qa_mask))
+        clear_pixels = qa_mask.size - masked_pixels
         # Since the nodata values is already masked, we should remove the difference
-        not_clear_pixels = qa_mask[qa_mask.mask].size - nodata_pixels
+        not_clear_pixels = masked_pixels - nodata_pixels
+    elif raster.dtype in (numpy.uint8, numpy.uint16):
+        # Compute how much data is for each class from the raster histogram, in a single pass
+        histogram = numpy.bincount(numpy.asarray(raster).ravel())
+        clear_pixels = _histogram_count(histogram, mask['clear_data'])
+        not_clear_pixels = _histogram_count(histogram, mask['not_clear_data'])
     else:
         # Compute how much data is for each class. It will be used as image area
-        clear_pixels = raster[numpy.where(numpy.isin(raster, mask['clear_data']))].size
-        not_clear_pixels = raster[numpy.where(numpy.isin(raster, mask['not_clear_data']))].size
+        clear_pixels = numpy.count_nonzero(numpy.isin(raster, mask['clear_data']))
+        not_clear_pixels = numpy.count_nonzero(numpy.isin(raster, mask['not_clear_data']))
+
+    return int(clear_pixels), int(not_clear_pixels)
+
+
+def _histogram_count(histogram: numpy.ndarray, values) -> int:
+    """Sum the ``histogram`` (from ``numpy.bincount``) entries of the given unique ``values``."""
+    values = numpy.unique(numpy.asarray(values).ravel())
+    values = values[(values >= 0) & (values < len(histogram))].astype(numpy.intp)
+
+    return int(histogram[values].sum())
 
+
+def _qa_ratios(clear_pixels: int, not_clear_pixels: int, total_pixels: int) -> Tuple[float, float]:
+    """Compute the efficacy and cloud factor from the pixel counts of :func:`_qa_pixel_counts`."""
     # Image area is everything, except nodata.
     image_area = clear_pixels + not_clear_pixels
     not_clear_ratio = 100
@@ -1453,7 +1796,8 @@ def build_cube_path(datacube: str, period: str, tile_id: str, version: int, band
                     format_path_cube: str = None,
                     format_item_cube: str = None,
                     composed: bool = False,
-                    **kwargs) -> Path:
+                    as_path: bool = True,
+                    **kwargs) -> Union[Path, str]:
     """Retrieve the path to the Data cube file in Brazil Data Cube Cluster.
 
     The following values are available for ``format_path_cube``:
@@ -1485,6 +1829,8 @@ def build_cube_path(datacube: str, period: str, tile_id: str, version: int, band
         format_item_cube (Optional[str]): Custom format while building data cube item name. Defaults
             to ``{datacube:upper}_V{version}_{tile_id}_{start_date}``.
         composed (bool): Flag to identify cube context (identity or composed). Defaults to ``False``.
+        as_path (bool): Return the value as :class:`pathlib.Path`. Use ``False`` to skip the path parsing
+            and get the plain string, when it is only given to rasterio/GDAL. Defaults to ``True``.
     """
     # Default prefix path is WORK_DIR
     prefix = prefix or Config.WORK_DIR
@@ -1492,28 +1838,26 @@ def build_cube_path(datacube: str, period: str, tile_id: str, version: int, band
     if composed:
         folder = 'composed'
 
-    version_str = 'v{0:03d}'.format(int(version))
-    path, row = tile_id[:3], tile_id[-3:]
-    # Manual start date reference
-    year = str(period[:4])
-    month = '{0:02d}'.format(int(period[5:7]))
-    day = '{0:02d}'.format(int(period[8:10]))
+    assert len(period) >= 10, f'Invalid period {period}. Expected YYYY-MM-DD[_YYYY-MM-DD].'
 
     fmt_kwargs = dict(
         datacube=datacube,
+        datacube_lower=datacube.lower(),
+        datacube_upper=datacube.upper(),
         prefix=prefix,
-        path=path, row=row,
+        path=tile_id[:3], row=tile_id[-3:],
         tile_id=tile_id,
-        year=year,
-        month=month,
-        day=day,
+        # Manual start date reference (already zero padded in ISO format)
+        year=period[:4],
+        month=period[5:7],
+        day=period[8:10],
         version=f'v{version}',  # New version format
-        version_legacy=version_str,
+        version_legacy='v%03d' % int(version),
         period=period,
     )
 
     if format_path_cube is None:
-        format_path_cube = '{prefix}/{folder}/{datacube:lower}/{version}/{path}/{row}/{year}/{month}/{day}/{filename}'
+        format_path_cube = DEFAULT_FORMAT_PATH_CUBE
 
     file_name = get_item_id(datacube, version, tile_id, period, fmt=format_item_cube)
 
@@ -1528,19 +1872,104 @@ def build_cube_path(datacube: str, period: str, tile_id: str, version: int, band
     fmt_kwargs['filename'] = file_name
     fmt_kwargs['folder'] = folder
 
-    return Path(FORMATTER.format(format_path_cube, **fmt_kwargs))
+    file_path = _format_template(format_path_cube, fmt_kwargs)
+
+    return Path(file_path) if as_path else file_path
+
+
+class CubePathBuilder:
+    """Build the file paths of a data cube item, like :func:`build_cube_path`.
+
+    The values which are fixed for a data cube (``prefix``, ``folder``, ``datacube`` and versions)
+    are prepared once in the constructor, so :meth:`path` only prepares the tile, period and file name.
+    Use it when building several paths of the same data cube, like the bands of a composed item.
+
+    Examples:
+        >> builder = CubePathBuilder('S2-16D', 2, composed=True)
+        >> builder.path('2017-01-01_2017-01-16', '012345', band='B04')
+    """
+
+    def __init__(self, datacube: str, version: int, prefix=None, composed: bool = False,
+                 format_path_cube: str = None, format_item_cube: str = None):
+        """Build a cube path builder. See :func:`build_cube_path` for the arguments."""
+        self.datacube = datacube
+        self.version = version
+        self.format_path_cube = format_path_cube or DEFAULT_FORMAT_PATH_CUBE
+        self.format_item_cube = format_item_cube
+
+        self._fixed = dict(
+            datacube=datacube,
+            datacube_lower=datacube.lower(),
+            datacube_upper=datacube.upper(),
+            prefix=prefix or Config.WORK_DIR,
+            folder='composed' if composed else 'identity',
+            version=f'v{version}',
+            version_legacy='v%03d' % int(version),
+        )
+
+    def path(self, period: str, tile_id: str, band: str = None, suffix: Union[str, None] = '.tif',
+             as_path: bool = True) -> Union[Path, str]:
+        """Retrieve the path of a data cube file for the given period and tile."""
+        assert len(period) >= 10, f'Invalid period {period}. Expected YYYY-MM-DD[_YYYY-MM-DD].'
+
+        file_name = get_item_id(self.datacube, self.version, tile_id, period, fmt=self.format_item_cube)
+
+        if band is not None:
+            file_name = f'{file_name}_{band}'
+
+        fmt_kwargs = dict(
+            self._fixed,
+            path=tile_id[:3], row=tile_id[-3:],
+            tile_id=tile_id,
+            year=period[:4],
+            month=period[5:7],
+            day=period[8:10],
+            period=period,
+            filename=f'{file_name}{suffix or ""}',
+        )
+
+        file_path = _format_template(self.format_path_cube, fmt_kwargs)
+
+        return Path(file_path) if as_path else file_path
+
+
+@lru_cache(maxsize=16)
+def _access_token_file(access_token: str) -> str:
+    """Write the GDAL header file of the access token once per process.
+
+    The file is created with ``tempfile.mkstemp`` (readable only by the owner) and removed at the interpreter exit.
+    """
+    fd, file_path = mkstemp(prefix='cube-builder-', suffix='.txt')
+    with os.fdopen(fd, 'w') as f:
+        f.write(f'X-Api-Key: {access_token}')
+
+    atexit.register(_remove_file, file_path)
+
+    return file_path
+
+
+def _remove_file(file_path: str):
+    """Remove a file, ignoring when it does not exist anymore."""
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
 
 
 @contextmanager
 def rasterio_access_token(access_token=None):
-    """Retrieve a context manager that wraps a temporary file containing the access token to be passed to STAC."""
-    with TemporaryDirectory() as tmp:
-        options = dict()
+    """Retrieve a context manager with the rasterio options to pass the access token to STAC.
 
-        if access_token:
-            tmp_file = Path(tmp) / f'{access_token}.txt'
-            with open(str(tmp_file), 'w') as f:
-                f.write(f'X-Api-Key: {access_token}')
-            options.update(GDAL_HTTP_HEADER_FILE=str(tmp_file))
+    The token is written in a header file only once and reused by the next calls with the same token.
+    """
+    options = dict()
 
-        yield options
+    if access_token:
+        file_path = _access_token_file(access_token)
+        if not os.path.exists(file_path):
+            # Removed by a temporary directory cleanup, write it again
+            _access_token_file.cache_clear()
+            file_path = _access_token_file(access_token)
+        options.update(GDAL_HTTP_HEADER_FILE=file_path)
+
+    yield options
@@ -17,9 +17,14 @@
 #
 """Define Brazil Data Cube Cube Builder routes."""
 
+import threading
+from concurrent.futures import Future
+from copy import copy
+
 from bdc_auth_client.decorators import oauth2
 # 3rdparty
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, abort, json, jsonify, request
+from marshmallow import ValidationError
 
 # Cube Builder
 from .celery.utils import list_queues
@@ -29,9 +34,111 @@ from .forms import (CubeDetailForm, CubeItemsForm, CubeStatusForm, DataCubeForm,
                     DataCubeProcessForm, GridForm, ListCubeForm, PeriodForm)
 from .version import __version__
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
 bp = Blueprint('cubes', import_name=__name__)
 
 
+def _auth(roles):
+    """Protect a route with the BDC-Auth ``oauth2`` decorator.
+
+    When ``BDC_AUTH_REQUIRED`` is disabled, the route is registered as is, without the authentication wrapper.
+    """
+    if Config.BDC_AUTH_REQUIRED:
+        return oauth2(required=True, roles=roles, throw_exception=True)
+    return lambda func: func
+
+
+def _get_json():
+    """Parse the request JSON body, using ``orjson`` when available.
+
+    The bodies larger than ``Config.MAX_JSON_BYTES`` are rejected with ``413`` before parsing. Since the
+    ``MAX_CONTENT_LENGTH`` is only applied by Werkzeug to the form data, the body is read from the stream
+    up to the limit, which also bounds the requests without ``Content-Length``.
+
+    Only bodies sent as JSON are read here, the others fall back to ``request.get_json()``
+    so the Flask behavior for missing or invalid content types is kept.
+    """
+    if not request.is_json:
+        return request.get_json()
+
+    if request.content_length is not None and request.content_length > Config.MAX_JSON_BYTES:
+        abort(413, f'Request body exceeds the limit of {Config.MAX_JSON_BYTES} bytes.')
+
+    data = request.stream.read(Config.MAX_JSON_BYTES + 1)
+    if len(data) > Config.MAX_JSON_BYTES:
+        abort(413, f'Request body exceeds the limit of {Config.MAX_JSON_BYTES} bytes.')
+
+    try:
+        return orjson.loads(data) if orjson is not None else json.loads(data)
+    except ValueError as e:
+        # Both orjson.JSONDecodeError and json.JSONDecodeError are ValueError
+        return request.on_json_loading_failed(e)
+
+
+def _conditional_response(result, status_code=200):
+    """Serialize the result with an ETag, answering ``304 Not Modified`` when it matches ``If-None-Match``."""
+    response = jsonify(result)
+    response.status_code = status_code
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+_inflight = dict()
+"""Map of the controller calls in progress and their shared results. See ``_coalesce``."""
+_inflight_lock = threading.Lock()
+_INFLIGHT_TIMEOUT = 30
+"""Maximum time in seconds that a request waits for the result of a call in progress."""
+
+
+def _coalesce(key, func, *args, **kwargs):
+    """Run ``func`` once for the concurrent requests with the same ``key``, sharing its result between them.
+
+    Used by the resources polled for many clients at same time, like the data cube items.
+    The waiting requests raise a copy of the ``func`` error, so the threads do not share the same exception instance.
+
+    Raises:
+        concurrent.futures.TimeoutError: when the call in progress takes more than ``_INFLIGHT_TIMEOUT`` seconds.
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+
+    if not owner:
+        error = future.exception(timeout=_INFLIGHT_TIMEOUT)
+        if error is not None:
+            raise copy(error).with_traceback(error.__traceback__)
+        return future.result()
+
+    try:
+        result = func(*args, **kwargs)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+
+# The forms hold no request state, so a single instance of each one is shared between the requests.
+_CUBE_STATUS_FORM = CubeStatusForm()
+_LIST_CUBE_FORM = ListCubeForm()
+_DATA_CUBE_FORM = DataCubeForm()
+_DATA_CUBE_METADATA_FORM = DataCubeMetadataForm()
+_CUBE_ITEMS_FORM = CubeItemsForm()
+_DATA_CUBE_PROCESS_FORM = DataCubeProcessForm()
+_CUBE_DETAIL_FORM = CubeDetailForm()
+_GRID_FORM = GridForm()
+_PERIOD_FORM = PeriodForm()
+
+
 @bp.route('/', methods=['GET'])
 def status():
     """Define a simple route to retrieve Cube-Builder API status."""
@@ -43,10 +150,10 @@ def status():
 
 
 @bp.route('/cube-status', methods=('GET', ))
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["read"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["read"])
 def cube_status(**kwargs):
     """Retrieve the cube processing state, which refers to total items and total to be done."""
-    form = CubeStatusForm()
+    form = _CUBE_STATUS_FORM
 
     args = request.args.to_dict()
 
@@ -60,19 +167,19 @@ def cube_status(**kwargs):
 
 @bp.route('/cubes', defaults=dict(cube_id=None), methods=['GET'])
 @bp.route('/cubes/<cube_id>', methods=['GET'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["read"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["read"])
 def list_cubes(cube_id, **kwargs):
     """List all data cubes available."""
     if cube_id is not None:
         message, status_code = CubeController.get_cube(cube_id)
 
     else:
-        form = ListCubeForm()
-        args = request.args.to_dict()
-        errors = form.validate(args)
-        if errors:
-            return errors, 400
-        data = form.load(args)
+        form = _LIST_CUBE_FORM
+        try:
+            # The form reads the query string values directly, without copying it into a dict
+            data = form.load(request.args)
+        except ValidationError as e:
+            return e.messages, 400
 
         message, status_code = CubeController.list_cubes(**data)
 
@@ -80,22 +187,20 @@ def list_cubes(cube_id, **kwargs):
 
 
 @bp.route('/cubes', methods=['POST'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["write"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["write"])
 def create_cube(**kwargs):
     """Define POST handler for datacube creation.
 
     Expects a JSON that matches with ``DataCubeForm``.
     """
-    form = DataCubeForm()
-
-    args = request.get_json()
+    form = _DATA_CUBE_FORM
 
-    errors = form.validate(args)
+    args = _get_json()
 
-    if errors:
-        return errors, 400
-
-    data = form.load(args)
+    try:
+        data = form.load(args)
+    except ValidationError as e:
+        return e.messages, 400
 
     cubes, status = CubeController.create(data)
 
@@ -103,22 +208,20 @@ def create_cube(**kwargs):
 
 
 @bp.route('/cubes/<int:cube_id>', methods=['PUT'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["write"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["write"])
 def update_cube_matadata(cube_id, **kwargs):
     """Define PUT handler for datacube Update.
 
     Expects a JSON that matches with ``DataCubeMetadataForm``.
     """
-    form = DataCubeMetadataForm()
-
-    args = request.get_json()
-
-    errors = form.validate(args)
+    form = _DATA_CUBE_METADATA_FORM
 
-    if errors:
-        return errors, 400
+    args = _get_json()
 
-    data = form.load(args)
+    try:
+        data = form.load(args)
+    except ValidationError as e:
+        return e.messages, 400
 
     message, status = CubeController.update(cube_id, data)
 
@@ -126,19 +229,23 @@ def update_cube_matadata(cube_id, **kwargs):
 
 
 @bp.route('/cubes/<cube_id>/tiles', methods=['GET'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["read"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["read"])
 def list_tiles(cube_id, **kwargs):
-    """List all data cube tiles already done."""
-    message, status_code = CubeController.list_tiles_cube(cube_id, only_ids=True)
+    """List all data cube tiles already done.
+
+    The optional query string parameter ``limit`` restricts the number of tiles retrieved.
+    """
+    limit = request.args.get('limit', type=int)
+    message, status_code = CubeController.list_tiles_cube(cube_id, only_ids=True, limit=limit)
 
     return jsonify(message), status_code
 
 
 @bp.route('/cubes/<cube_id>/parameters', methods=['PUT'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["write"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["write"])
 def update_cube_parameters(cube_id, **kwargs):
     """Update the data cube parameters execution."""
-    parameters = request.get_json()
+    parameters = _get_json()
 
     message = CubeController.configure_parameters(int(cube_id), **parameters)
 
@@ -146,7 +253,7 @@ def update_cube_parameters(cube_id, **kwargs):
 
 
 @bp.route('/cubes/<cube_id>/complete', methods=['POST'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["write"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["write"])
 def complete_cube_timeline(cube_id, **kwargs):
     """Complete the data cube missing time steps."""
     result = CubeController.complete_cube_timeline(cube_id)
@@ -154,7 +261,7 @@ def complete_cube_timeline(cube_id, **kwargs):
 
 
 @bp.route('/cubes/<int:cube_id>/tiles/geom', methods=['GET'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["read"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["read"])
 def list_tiles_as_features(cube_id, **kwargs):
     """List all tiles as GeoJSON feature."""
     message, status_code = CubeController.list_tiles_cube(int(cube_id))
@@ -163,10 +270,10 @@ def list_tiles_as_features(cube_id, **kwargs):
 
 
 @bp.route('/cubes/<int:cube_id>/items', methods=['GET'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["read"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["read"])
 def list_cube_items(cube_id, **kwargs):
     """List all data cube items."""
-    form = CubeItemsForm()
+    form = _CUBE_ITEMS_FORM
 
     args = request.args.to_dict()
 
@@ -175,13 +282,14 @@ def list_cube_items(cube_id, **kwargs):
     if errors:
         return errors, 400
 
-    message, status_code = CubeController.list_cube_items(cube_id, **args)
+    key = ('list_cube_items', cube_id, tuple(sorted(args.items())))
+    message, status_code = _coalesce(key, CubeController.list_cube_items, cube_id, **args)
 
     return jsonify(message), status_code
 
 
 @bp.route('/cubes/<int:cube_id>/meta', methods=['GET'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["read"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["read"])
 def get_cube_meta(cube_id, **kwargs):
     """Retrieve the meta information of a data cube such STAC provider used, collection, etc."""
     message, status_code = CubeController.cube_meta(cube_id)
@@ -190,22 +298,21 @@ def get_cube_meta(cube_id, **kwargs):
 
 
 @bp.route('/start', methods=['POST'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["write"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["write"])
 def start_cube(**kwargs):
     """Define POST handler for datacube execution.
 
     Expects a JSON that matches with ``DataCubeProcessForm``.
     """
-    args = request.get_json()
+    args = _get_json()
 
-    form = DataCubeProcessForm()
+    form = _DATA_CUBE_PROCESS_FORM
 
-    errors = form.validate(args)
-
-    if errors:
-        return errors, 400
+    try:
+        data = form.load(args)
+    except ValidationError as e:
+        return e.messages, 400
 
-    data = form.load(args)
     # For Local Data Sources, there is no reference for collections.
     if data.get('local'):
         data['collections'] = None
@@ -216,7 +323,7 @@ def start_cube(**kwargs):
 
 
 @bp.route('/list-merges', methods=['GET'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["read"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["read"])
 def list_merges(**kwargs):
     """Define POST handler for datacube execution.
 
@@ -224,7 +331,7 @@ def list_merges(**kwargs):
     """
     args = request.args.to_dict()
 
-    form = CubeDetailForm()
+    form = _CUBE_DETAIL_FORM
     errors = form.validate(args)
     if errors:
         return errors, 400
@@ -232,37 +339,38 @@ def list_merges(**kwargs):
     if args['cube_id'].isnumeric():
         args['cube_id'] = int(args['cube_id'])
 
-    res = CubeController.check_for_invalid_merges(**args)
+    key = ('list_merges', tuple(sorted(args.items())))
+    res = _coalesce(key, CubeController.check_for_invalid_merges, **args)
 
     return res
 
 
 @bp.route('/grids', defaults=dict(grs_id=None), methods=['GET'])
 @bp.route('/grids/<grs_id>', methods=['GET'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["read"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["read"])
 def list_grs_schemas(grs_id, **kwargs):
     """List all data cube Grids."""
     if grs_id is not None:
-        args = request.args.to_dict()
-        bbox = args.get('bbox')
+        bbox = request.args.get('bbox')
         if bbox:
             bbox = [float(elm) for elm in bbox.split(',')]
-        tiles = args.get('tiles')
+        tiles = request.args.get('tiles')
         tiles = tiles.split(',') if tiles else None
         result, status_code = CubeController.get_grs_schema(grs_id, bbox=bbox, tiles=tiles)
     else:
         result, status_code = CubeController.list_grs_schemas()
+        return _conditional_response(result, status_code)
 
     return jsonify(result), status_code
 
 
 @bp.route('/create-grids', methods=['POST'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["write"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["write"])
 def create_grs(**kwargs):
     """Create the grid reference system using HTTP Post method."""
-    form = GridForm()
+    form = _GRID_FORM
 
-    args = request.get_json()
+    args = _get_json()
 
     errors = form.validate(args)
 
@@ -275,7 +383,7 @@ def create_grs(**kwargs):
 
 
 @bp.route('/list-periods', methods=['POST'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["read"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["read"])
 def list_periods(**kwargs):
     """List data cube periods.
 
@@ -285,9 +393,9 @@ def list_periods(**kwargs):
     - start_date: Start offset
     - last_date: End date offset
     """
-    parser = PeriodForm()
+    parser = _PERIOD_FORM
 
-    args = request.get_json()
+    args = _get_json()
 
     errors = parser.validate(args)
 
@@ -298,17 +406,17 @@ def list_periods(**kwargs):
 
 
 @bp.route('/composite-functions', methods=['GET'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["read"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["read"])
 def list_composite_functions(**kwargs):
     """List all data cube supported composite functions."""
     message, status_code = CubeController.list_composite_functions()
 
-    return jsonify(message), status_code
+    return _conditional_response(message, status_code)
 
 
 @bp.route('/tasks', methods=['GET'])
-@oauth2(required=Config.BDC_AUTH_REQUIRED, roles=["read"], throw_exception=Config.BDC_AUTH_REQUIRED)
+@_auth(["read"])
 def list_tasks(**kwargs):
     """List all pending and running tasks on celery."""
     queues = list_queues()
-    return queues
+    return _conditional_response(queues)
@@ -19,15 +19,18 @@
 import os
 # 3rdparty
 import sphinx_rtd_theme
-# Cube Builder
-import cube_builder
 
 # -- Project information -----------------------------------------------------
 
 project = 'cube-builder'
 copyright = '2022, INPE'
 author = 'Brazil Data Cube Team'
-release = cube_builder.__version__
+
+# Read the version without importing the package and its dependencies.
+with open(os.path.join(os.path.dirname(__file__), '..', '..', 'cube_builder', 'version.py'), 'rt') as fp:
+    g = {}
+    exec(fp.read(), g)
+    release = g['__version__']
 
 # -- General configuration ---------------------------------------------------
 
@@ -47,10 +47,20 @@ histogram_require = [
     'scikit-image>=0.18,<1'
 ]
 
+numexpr_require = [
+    'numexpr>=2.8'
+]
+
+orjson_require = [
+    'orjson>=3.6'
+]
+
 extras_require = {
     'docs': docs_require,
     'tests': tests_require,
     'histogram': histogram_require,
+    'numexpr': numexpr_require,
+    'orjson': orjson_require,
     'amqp': [
         'amqp>=5.0'
     ]
@@ -19,13 +19,18 @@
 """Test the API cube_builder.views."""
 
 import datetime
+import threading
 
+import pytest
+from bdc_catalog.models import Band, BandSRC, Collection, db
 from click.testing import CliRunner
 from dateutil.relativedelta import relativedelta
 from flask import Response
 
-from cube_builder import __version__
+from cube_builder import __version__, views
 from cube_builder.cli import cli
+from cube_builder.config import Config
+from cube_builder.forms import BandForm
 
 
 def _assert_json_request(response: Response, status_code=200):
@@ -68,6 +73,44 @@ def test_create_cube(client, json_data):
     # TODO: validate json response with jsonschema api
 
 
+def test_create_cube_band_metadata(app, json_data):
+    """Ensure the EO metadata and index expressions are stored for the created cube bands."""
+    json_cube = json_data['lc8-16d-stk.json']
+    identifier = f"{json_cube['datacube']}-{json_cube['version']}"
+    cube = Collection.query().filter(Collection.identifier == identifier).first()
+    assert cube is not None
+
+    bands = {band.name: band for band in Band.query().filter(Band.collection_id == cube.id).all()}
+
+    eo_band = Band()
+    eo_band.add_eo_meta(resolution_x=json_cube['resolution'], resolution_y=json_cube['resolution'])
+
+    for band in bands.values():
+        for key, value in eo_band.metadata_.items():
+            assert band.metadata_[key] == value
+
+    for index in json_cube['indexes']:
+        band = bands[index['name']]
+        expression = band.metadata_['expression']
+        band_src_ids = [bands[name].id for name in index['metadata']['expression']['bands']]
+
+        assert expression['value'] == index['metadata']['expression']['value']
+        assert expression['bands'] == band_src_ids
+
+        band_sources = db.session.query(BandSRC).filter(BandSRC.band_id == band.id).all()
+        assert sorted(row.band_src_id for row in band_sources) == sorted(band_src_ids)
+
+
+def test_request_body_limit(client, monkeypatch):
+    monkeypatch.setattr(Config, 'MAX_JSON_BYTES', 1024)
+
+    response = client.post('/cubes', json=dict(datacube='X' * 2048))
+    _assert_json_request(response, 413)
+
+    response = client.put('/cubes/1', json=dict(title='X' * 2048))
+    _assert_json_request(response, 413)
+
+
 def test_list_composite_functions(client):
     response = client.get('/composite-functions')
 
@@ -139,6 +182,29 @@ def test_update_cube_meta(client):
     _assert_json_request(response, 400)
 
 
+def test_update_cube_bands(client):
+    cube = _get_first_cube(client)
+
+    bands = BandForm(many=True).dump(Band.query().filter(Band.collection_id == cube['id']).all())
+    assert len(bands) > 0
+    for band in bands:
+        band['description'] = f'{band["name"]} - Updated'
+        band['metadata_'] = dict(band.get('metadata_') or {}, updated=True)
+
+    response = client.put(f'/cubes/{cube["id"]}', json=dict(bands=bands))
+    _assert_json_request(response, 200)
+
+    db.session.expire_all()
+    for band in Band.query().filter(Band.collection_id == cube['id']).all():
+        assert band.description == f'{band.name} - Updated'
+        assert band.metadata_['updated'] is True
+
+    # Band of another data cube
+    bands[0]['collection_id'] = cube['id'] + 1
+    response = client.put(f'/cubes/{cube["id"]}', json=dict(bands=bands[:1]))
+    _assert_json_request(response, 400)
+
+
 def test_list_cube_tiles(client):
     cube = _get_first_cube(client)
 
@@ -146,6 +212,88 @@ def test_list_cube_tiles(client):
     _assert_json_request(response, 200)
 
 
+class _InflightCalls(dict):
+    """Map of the coalesced calls which notifies when a request waits for a call in progress."""
+
+    def __init__(self):
+        super().__init__()
+        self.waiting = threading.Event()
+
+    def get(self, key, default=None):
+        future = super().get(key, default)
+        if future is not None:
+            self.waiting.set()
+        return future
+
+
+@pytest.fixture()
+def inflight(monkeypatch):
+    calls = _InflightCalls()
+    monkeypatch.setattr(views, '_inflight', calls)
+    return calls
+
+
+def _run_coalesced(inflight, func, call):
+    """Run the owner call of ``func`` and a second call while the first one is in progress."""
+    started = threading.Event()
+    release = threading.Event()
+
+    def wrapper(*args):
+        started.set()
+        assert release.wait(5)
+        return func(*args)
+
+    threads = [threading.Thread(target=call, args=(wrapper,)) for _ in range(2)]
+    threads[0].start()
+    assert started.wait(5)
+    threads[1].start()
+    assert inflight.waiting.wait(5)
+    release.set()
+
+    for thread in threads:
+        thread.join(5)
+        assert not thread.is_alive()
+
+
+def test_coalesce_concurrent_calls(inflight):
+    calls = []
+    results = []
+
+    def func(value):
+        calls.append(value)
+        return value * 2
+
+    _run_coalesced(inflight, func, lambda wrapper: results.append(views._coalesce('key', wrapper, 21)))
+
+    assert calls == [21]
+    assert results == [42, 42]
+    assert 'key' not in inflight
+
+
+def test_coalesce_exception(inflight):
+    errors = []
+
+    def func():
+        raise RuntimeError('failed')
+
+    def call(wrapper):
+        try:
+            views._coalesce('key', wrapper)
+        except RuntimeError as e:
+            errors.append(e)
+
+    _run_coalesced(inflight, func, call)
+
+    assert [str(e) for e in errors] == ['failed', 'failed']
+    assert errors[0] is not errors[1]
+    assert 'key' not in inflight
+
+    # The key is removed after the failure, so the next call runs again
+    with pytest.raises(RuntimeError):
+        views._coalesce('key', func)
+    assert views._coalesce('key', lambda: 'ok') == 'ok'
+
+
 def _get_first_cube(client):
     response = client.get('/cubes')
     cubes = _assert_json_request(response, 200)
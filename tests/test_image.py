@@ -18,9 +18,10 @@
 
 """Define the unittests for cube_builder.utils.image module."""
 
-from tempfile import NamedTemporaryFile, TemporaryDirectory
+from tempfile import TemporaryDirectory
 
 import numpy
+import pytest
 import rasterio
 from rasterio.crs import CRS
 from rasterio.warp import Affine
@@ -38,16 +39,26 @@ RASTER_OPTIONS = dict(
                         -29.99952920102161, 9217407.901105449)
 )
 
-RASTER_DATA = numpy.random.randint(100, size=(RASTER_OPTIONS['width'], RASTER_OPTIONS['height'])).astype(numpy.int16)
 
+@pytest.fixture(scope='session')
+def raster_data():
+    """Build the random raster data used by the tests."""
+    return numpy.random.randint(100, size=(RASTER_OPTIONS['width'], RASTER_OPTIONS['height'])).astype(numpy.int16)
 
-def test_check_file_integrity():
-    """Test the file integrity checking."""
-    temp_file = NamedTemporaryFile()
-    with rasterio.open(temp_file.name, 'w', **RASTER_OPTIONS) as ds:
-        ds.write(RASTER_DATA, 1)
 
-    assert image.check_file_integrity(temp_file.name)
+@pytest.fixture(scope='module')
+def raster_file(tmp_path_factory, raster_data):
+    """Write the raster data into a GeoTIFF file shared by the module tests."""
+    file_path = str(tmp_path_factory.mktemp('raster') / 'raster.tif')
+    with rasterio.open(file_path, 'w', **RASTER_OPTIONS) as ds:
+        ds.write(raster_data, 1)
+
+    return file_path
+
+
+def test_check_file_integrity(raster_file):
+    """Test the file integrity checking."""
+    assert image.check_file_integrity(raster_file)
     assert not image.check_file_integrity('/tmp/not-exists.tif')
 
 
@@ -93,6 +104,24 @@ def test_rescale_raster():
     assert numpy.array_equal(res, expected)
 
 
+def test_rescale_masked_raster():
+    """Test that the rescale keeps the values under the mask, like nodata."""
+    nodata = -9999
+    arr2d = numpy.array([
+        [17834, nodata, 8275],
+        [nodata, 19081, 21684],
+    ], dtype=numpy.int16)
+    masked = numpy.ma.masked_equal(arr2d, nodata)
+
+    res = image.rescale(masked, 0.0000275, new_scale=0.0001, origin_additive=-0.2)
+
+    assert isinstance(res, numpy.ma.MaskedArray)
+    assert res.dtype == numpy.int16
+    assert numpy.array_equal(numpy.ma.getmaskarray(res), arr2d == nodata)
+    assert numpy.all(res.data[arr2d == nodata] == nodata)
+    assert numpy.array_equal(res.compressed(), [2904, 275, 3247, 3963])
+
+
 def test_linear_raster_scale():
     """Test linear raster scaling to transform band values int16 into byte."""
     arr2d = numpy.random.randint(0, 10000, (10, 10), dtype=numpy.uint16)
@@ -108,13 +137,13 @@ def test_linear_raster_scale():
     assert 0 <= rescaled_arr2d.min() <= rescaled_arr2d.max()
 
 
-def test_bit_extraction():
+@pytest.mark.parametrize('position', [0, 1, 3, 5])
+def test_bit_extraction(position):
     """Test bit extraction from any value (used for Landsat sensors)."""
     # 43 => 0010 1011
-    for position in [0, 1, 3, 5]:
-        bit_pos_value = image.extract_qa_bits(43, position)
-        expected = 2 ** position
-        assert bit_pos_value == expected
+    bit_pos_value = image.extract_qa_bits(43, position)
+    expected = 2 ** position
+    assert bit_pos_value == expected
 
 
 def test_radsat_bit():
@@ -21,8 +21,12 @@
 import os
 from pathlib import Path
 
+import numpy
+import rasterio
+from rasterio.transform import from_origin
+
 from cube_builder.config import Config
-from cube_builder.utils.processing import build_cube_path
+from cube_builder.utils.processing import CubePathBuilder, blend, build_cube_path, merge
 
 
 def assert_data_cube_path(datacube, period, tile_id, version, expected_base_path, band=None, prefix=Config.DATA_DIR,
@@ -54,6 +58,16 @@ def assert_data_cube_path(datacube, period, tile_id, version, expected_base_path
     assert str(absolute_datacube_path.parent) == expected_path
     assert absolute_datacube_path.name == expected_file_name
 
+    raw_datacube_path = build_cube_path(datacube, period, tile_id, version, band=band, prefix=prefix,
+                                        format_path_cube=format_path_cube,
+                                        format_item_cube=format_item_cube,
+                                        composed=folder == 'composed', as_path=False)
+    assert raw_datacube_path == str(absolute_datacube_path)
+
+    builder = CubePathBuilder(datacube, version, prefix=prefix, composed=folder == 'composed',
+                              format_path_cube=format_path_cube, format_item_cube=format_item_cube)
+    assert builder.path(period, tile_id, band=band) == absolute_datacube_path
+
 
 def test_datacube_paths():
     """Test directive for data cube base paths."""
@@ -70,3 +84,95 @@ def test_datacube_paths():
         assert_data_cube_path(datacube, date, tile_id, version, 'identity', band=band, prefix=prefix, legacy=True)
         # Composed
         assert_data_cube_path(f'{datacube}-1M', period, tile_id, version, 'composed', band=band, prefix=prefix)
+
+
+def test_merge_profile(tmp_path, monkeypatch):
+    """Test that the merged file has the tile grid and the band profile."""
+    monkeypatch.setattr(Config, 'CHECK_ASSET_ACCESS', False)
+    assets = []
+    for position in range(2):
+        asset_file = str(tmp_path / f'asset_{position}.tif')
+        with rasterio.open(asset_file, 'w', driver='GTiff', width=32, height=32, count=1, dtype='int16',
+                           nodata=-9999, crs='EPSG:32723',
+                           transform=from_origin(500000 + position * 480, 8000000, 30, 30)) as data_set:
+            data_set.write(numpy.full((32, 32), 100 * (position + 1), dtype='int16'), 1)
+        assets.append(dict(link=asset_file, dataset='S2_L2A-1', nodata=-9999, platform=''))
+
+    band_map = dict(nir=dict(nodata=-9999, data_type='int16'))
+    merge_file = tmp_path / 'merge' / 'nir.tif'
+
+    result = merge(str(merge_file), dict(), assets, 'nir', band_map, 'Fmask4', 'S2_L2A-1', xmin=500000,
+                   ymax=8000000, dist_x=1920, dist_y=960, resx=30, resy=30, srs='EPSG:32723', datasets=['S2_L2A-1'])
+
+    with rasterio.open(result['file']) as data_set:
+        profile = data_set.profile
+        raster = data_set.read(1)
+
+    assert profile['driver'] == 'GTiff'
+    assert profile['count'] == 1
+    assert profile['dtype'] == 'int16'
+    assert profile['nodata'] == -9999
+    assert (profile['width'], profile['height']) == (64, 32)
+    assert data_set.crs.to_epsg() == 32723
+    assert profile['transform'] == from_origin(500000, 8000000, 30, 30)
+    assert (raster[:, :16] == 100).all() and (raster[:, 16:48] == 200).all() and (raster[:, 48:] == -9999).all()
+
+
+def _blend_activity(directory: Path, nir_values, efficacies, composite_function='LCF'):
+    """Write the merge files of a blend activity with clear quality, one scene for each nir value."""
+    profile = dict(driver='GTiff', width=16, height=16, count=1, crs='EPSG:32723',
+                   transform=from_origin(500000, 8000000, 30, 30))
+    scenes = dict()
+
+    for day, (nir, efficacy) in enumerate(zip(nir_values, efficacies), start=1):
+        date = f'2020-01-{day:02d}'
+        quality_file, nir_file = str(directory / f'{date}_Fmask4.tif'), str(directory / f'{date}_nir.tif')
+
+        with rasterio.open(quality_file, 'w', dtype='uint8', nodata=255, **profile) as data_set:
+            data_set.write(numpy.zeros((16, 16), dtype='uint8'), 1)
+        with rasterio.open(nir_file, 'w', dtype='int16', nodata=-9999, **profile) as data_set:
+            data_set.write(nir.astype('int16'), 1)
+
+        scenes[date] = dict(ARDfiles=dict(Fmask4=quality_file, nir=nir_file), efficacy=efficacy, resolution=30)
+
+    return dict(band='nir', mask=dict(clear_data=[0, 1], not_clear_data=[2, 3, 4], nodata=255), version=1,
+                scenes=scenes, datasets=['S2'], composite_function=composite_function,
+                datacube=f'S2_10_16D_{composite_function}', period='2020-01-01_2020-01-16', tile_id='000001')
+
+
+def _read_band(file_path):
+    with rasterio.open(file_path) as data_set:
+        return data_set.read(1)
+
+
+def test_blend_valid_range(tmp_path, monkeypatch):
+    """Test that the blend does not compose the observations out of the valid range."""
+    monkeypatch.setattr(Config, 'WORK_DIR', str(tmp_path / 'work'))
+    band_map = dict(nir=dict(nodata=-9999, min_value=0, max_value=10000, data_type='int16'),
+                    Fmask4=dict(nodata=255, min_value=0, max_value=4, data_type='uint8'))
+
+    best = numpy.full((16, 16), 500)
+    best[0, 0] = 15000
+    best[1, 1] = -50
+    best[2, 2] = 12000
+    worst = numpy.full((16, 16), 700)
+    worst[2, 2] = -9999
+    valid = numpy.ones((16, 16), dtype=bool)
+    valid[:3, :3] = False
+
+    for composite_function in ('LCF', 'MED'):
+        activity = _blend_activity(tmp_path, [best, worst], efficacies=[90, 50], composite_function=composite_function)
+
+        result = blend(activity, band_map, 'Fmask4', build_clear_observation=True, apply_valid_range=True)
+
+        raster = _read_band(result['blends'][composite_function])
+        clear_observation = _read_band(result['clear_observation_file'])
+
+        # The out of range values are replaced by the next valid observation, otherwise they are nodata
+        assert raster[0, 0] == 700
+        assert raster[1, 1] == 700
+        assert raster[2, 2] == -9999
+        assert (raster[valid] == (500 if composite_function == 'LCF' else 600)).all()
+
+        assert clear_observation[0, 0] == clear_observation[1, 1] == 1
+        assert (clear_observation[valid] == 2).all()
@@ -0,0 +1,93 @@
+#
+# This file is part of Cube Builder.
+# Copyright (C) 2022 INPE.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/gpl-3.0.html>.
+#
+
+"""Define the unittests for cube_builder.utils helpers."""
+
+from unittest import mock
+
+import pytest
+
+from cube_builder.utils import ttl_cache
+
+
+class _Clock:
+    """Replace ``time.monotonic`` with a clock moved by the tests."""
+
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def clock():
+    _clock = _Clock()
+    with mock.patch('cube_builder.utils.time.monotonic', _clock):
+        yield _clock
+
+
+def _counted(ttl):
+    calls = []
+
+    @ttl_cache(ttl)
+    def func(value):
+        calls.append(value)
+        return value * 2
+
+    return func, calls
+
+
+def test_ttl_cache_hit(clock):
+    func, calls = _counted(ttl=30)
+
+    assert func(1) == 2
+    clock.now += 29
+    assert func(1) == 2
+    assert func(value=1) == 2
+    assert calls == [1, 1]
+
+
+def test_ttl_cache_expired(clock):
+    func, calls = _counted(ttl=30)
+
+    assert func(1) == 2
+    clock.now += 30
+    assert func(1) == 2
+    assert calls == [1, 1]
+
+
+def test_ttl_cache_evict_expired(clock):
+    func, calls = _counted(ttl=30)
+
+    func(1)
+    clock.now += 31
+    func(2)
+    # The expired result of 1 was dropped when 2 was stored
+    clock.now -= 31
+    func(1)
+    assert calls == [1, 2, 1]
+
+
+def test_ttl_cache_clear(clock):
+    func, calls = _counted(ttl=30)
+
+    func(1)
+    func.cache_clear()
+    func(1)
+    assert calls == [1, 1]